@@ -0,0 +1,308 @@
+# account_pool.py
+"""
+Pool of TradingView accounts (sessionid / tv_ecuid pairs) shared by all workers.
+
+TRADINGVIEW_ACCOUNTS is a JSON list; `scripts` are fnmatch patterns on the
+script URL, `max_leases` caps concurrent grants on one session:
+
+    [{"name": "main", "sessionid": "...", "ecuid": "...",
+      "scripts": ["https://www.tradingview.com/script/AbC123*"], "max_leases": 2}]
+
+Without it, the single TRADINGVIEW_SESSIONID / TRADINGVIEW_ECUID pair is used
+as account "default" for every script, uncapped unless ACCOUNT_MAX_LEASES is
+set (0 = no cap).
+
+  * Leases: each account has a ZSET of lease tokens scored by expiry, so a
+    crashed worker's lease runs out on its own. A held lease is renewed every
+    ACCOUNT_LEASE_SECONDS / 3, so long batches keep it.
+  * Health: a cheap logged-in check every ACCOUNT_HEALTH_INTERVAL_SECONDS
+    (one process per interval runs it). Expired sessions are taken out of the
+    pool until a later check sees them logged in again. If every account fails
+    the check, the check itself is suspect (challenge page, new markup) and
+    nobody is taken out; a real grant's SessionExpiredError still is.
+  * storage_state: cached per account after a successful grant, so new
+    contexts start from the full authenticated state instead of two cookies.
+
+    python account_pool.py   # run the health check once and print the result
+"""
+import os
+import re
+import json
+import time
+import uuid
+import fnmatch
+import asyncio
+import urllib.request
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Optional
+from redis_client import get_redis
+from grant_errors import SessionExpiredError, TransientError
+
+ACCOUNT_LEASE_SECONDS = int(os.getenv("ACCOUNT_LEASE_SECONDS", "300"))
+ACCOUNT_LEASE_WAIT_SECONDS = float(os.getenv("ACCOUNT_LEASE_WAIT_SECONDS", "60"))
+# Default cap for TRADINGVIEW_ACCOUNTS entries; the legacy single account is uncapped unless set
+ACCOUNT_MAX_LEASES = int(os.getenv("ACCOUNT_MAX_LEASES", "2"))
+ACCOUNT_HEALTH_INTERVAL_SECONDS = int(os.getenv("ACCOUNT_HEALTH_INTERVAL_SECONDS", "600"))
+ACCOUNT_STATE_TTL_SECONDS = int(os.getenv("ACCOUNT_STATE_TTL_SECONDS", "21600"))
+# Any page that embeds the logged-in user; anonymous visitors get no username
+ACCOUNT_CHECK_URL = os.getenv("ACCOUNT_CHECK_URL", "https://www.tradingview.com/")
+ACCOUNT_LOGGED_IN_RE = re.compile(os.getenv("ACCOUNT_LOGGED_IN_RE", r'"username"\s*:\s*"[^"]+"'))
+
+LEASE_KEY = "grant:account:lease:{name}"    # ZSET token -> lease expiry
+HEALTH_KEY = "grant:account:health"         # hash name -> {"ok", "reason", "checked_at"}
+HEALTH_LOCK_KEY = "grant:account:health:lock"
+STATE_KEY = "grant:account:state:{name}"    # cached Playwright storage_state
+
+# Drop expired leases, then take one if the account is below its cap (0 = no cap)
+LEASE_LUA = """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+local cap = tonumber(ARGV[2])
+if cap > 0 and redis.call('ZCARD', KEYS[1]) >= cap then
+    return 0
+end
+redis.call('ZADD', KEYS[1], ARGV[3], ARGV[4])
+redis.call('EXPIRE', KEYS[1], ARGV[5])
+return 1
+"""
+
+
+@dataclass
+class Account:
+    name: str
+    sessionid: str
+    ecuid: str
+    scripts: list = field(default_factory=lambda: ["*"])
+    max_leases: int = ACCOUNT_MAX_LEASES
+
+    def can_manage(self, script_url: str) -> bool:
+        return any(fnmatch.fnmatch(script_url, pattern) for pattern in self.scripts)
+
+    def cookies(self) -> list:
+        return [
+            {
+                "name": "sessionid",
+                "value": self.sessionid,
+                "domain": ".tradingview.com",
+                "path": "/",
+                "httpOnly": True,
+                "secure": True,
+                "sameSite": "Lax",
+            },
+            {
+                "name": "tv_ecuid",
+                "value": self.ecuid,
+                "domain": ".tradingview.com",
+                "path": "/",
+                "httpOnly": False,
+                "secure": True,
+                "sameSite": "Lax",
+            },
+        ]
+
+
+_accounts: Optional[dict] = None
+_lease_script = None
+
+
+def load_accounts() -> dict:
+    """name -> Account. Read from the env once per process (at first use, so imports never fail)."""
+    global _accounts
+    if _accounts is not None:
+        return _accounts
+    raw = os.getenv("TRADINGVIEW_ACCOUNTS")
+    accounts = {}
+    if raw:
+        for spec in json.loads(raw):
+            acct = Account(
+                name=spec["name"], sessionid=spec["sessionid"], ecuid=spec["ecuid"],
+                scripts=spec.get("scripts") or ["*"], max_leases=int(spec.get("max_leases", ACCOUNT_MAX_LEASES)),
+            )
+            accounts[acct.name] = acct
+    elif os.getenv("TRADINGVIEW_SESSIONID") and os.getenv("TRADINGVIEW_ECUID"):
+        accounts["default"] = Account(
+            "default", os.getenv("TRADINGVIEW_SESSIONID"), os.getenv("TRADINGVIEW_ECUID"),
+            max_leases=int(os.getenv("ACCOUNT_MAX_LEASES", "0")),
+        )
+    if not accounts:
+        raise RuntimeError("Missing TRADINGVIEW_ACCOUNTS (or TRADINGVIEW_SESSIONID / TRADINGVIEW_ECUID)")
+    _accounts = accounts
+    return accounts
+
+
+def get_account(name: Optional[str] = None) -> Account:
+    """The named account, or the first configured one."""
+    accounts = load_accounts()
+    if name is None:
+        return next(iter(accounts.values()))
+    return accounts[name]
+
+
+# ---------- Health ----------
+def _health() -> dict:
+    try:
+        return {name: json.loads(v) for name, v in get_redis().hgetall(HEALTH_KEY).items()}
+    except Exception:
+        return {}
+
+
+def mark_health(name: str, ok: bool, reason: str = ""):
+    try:
+        get_redis().hset(HEALTH_KEY, name, json.dumps({"ok": ok, "reason": reason, "checked_at": time.time()}))
+        if not ok:
+            get_redis().delete(STATE_KEY.format(name=name))
+    except Exception as e:
+        print(f"⚠️ Could not record health of account {name}: {e}")
+    if not ok:
+        print(f"🚫 Account {name} taken out of the pool: {reason}")
+
+
+def accounts_for(script_url: str) -> list:
+    """Names of healthy accounts that can manage `script_url`. Accounts never checked count as healthy."""
+    health = _health()
+    return [
+        a.name for a in load_accounts().values()
+        if a.can_manage(script_url) and health.get(a.name, {}).get("ok", True)
+    ]
+
+
+def check_session(account: Account, timeout: float = 10) -> tuple:
+    """(logged_in, reason) from one plain GET with the account's cookies."""
+    req = urllib.request.Request(ACCOUNT_CHECK_URL, headers={
+        "Cookie": f"sessionid={account.sessionid}; tv_ecuid={account.ecuid}",
+        "User-Agent": "Mozilla/5.0",
+    })
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            body = resp.read(512 * 1024).decode("utf-8", "replace")
+            final_url = resp.geturl()
+    except Exception as e:
+        # Network trouble says nothing about the session; keep the last verdict
+        return None, f"check failed: {e}"
+    if "/accounts/signin" in final_url:
+        return False, "redirected to sign-in"
+    if not ACCOUNT_LOGGED_IN_RE.search(body):
+        return False, "page is not logged in"
+    return True, ""
+
+
+def run_health_checks() -> dict:
+    """Check every account now; name -> ok (None when the check was inconclusive)."""
+    checks = {acct.name: check_session(acct) for acct in load_accounts().values()}
+    # Not one account looks logged in: more likely the check is broken than every session
+    all_failed = not any(ok for ok, _ in checks.values())
+    results = {}
+    for name, (ok, reason) in checks.items():
+        if ok is False and all_failed:
+            ok, reason = None, f"{reason} (every account failed the check)"
+        results[name] = ok
+        if ok is None:
+            print(f"⚠️ Health check for account {name} inconclusive: {reason}")
+        else:
+            mark_health(name, ok, reason)
+    return results
+
+
+def check_due() -> Optional[dict]:
+    """Run the health checks if no process has in the last interval."""
+    try:
+        if not get_redis().set(HEALTH_LOCK_KEY, "1", nx=True, ex=ACCOUNT_HEALTH_INTERVAL_SECONDS):
+            return None
+    except Exception:
+        return None
+    return run_health_checks()
+
+
+# ---------- Leases ----------
+def _try_lease(account: Account, token: str) -> bool:
+    global _lease_script
+    now = time.time()
+    try:
+        if _lease_script is None:
+            _lease_script = get_redis().register_script(LEASE_LUA)
+        return bool(_lease_script(
+            keys=[LEASE_KEY.format(name=account.name)],
+            args=[now, account.max_leases, now + ACCOUNT_LEASE_SECONDS, token, ACCOUNT_LEASE_SECONDS * 2],
+        ))
+    except Exception as e:
+        # Fail open like the ledger: without Redis, grant unthrottled rather than not at all
+        print(f"⚠️ Could not lease account {account.name}: {e}")
+        return True
+
+
+async def _renew(account: Account, token: str):
+    """Push the lease's expiry forward while the block holding it runs."""
+    key = LEASE_KEY.format(name=account.name)
+    while True:
+        await asyncio.sleep(ACCOUNT_LEASE_SECONDS / 3)
+        try:
+            pipe = get_redis().pipeline(transaction=False)
+            pipe.zadd(key, {token: time.time() + ACCOUNT_LEASE_SECONDS}, xx=True)
+            pipe.expire(key, ACCOUNT_LEASE_SECONDS * 2)
+            pipe.execute()
+        except Exception as e:
+            print(f"⚠️ Could not renew lease on account {account.name}: {e}")
+
+
+def _release(account: Account, token: str):
+    try:
+        get_redis().zrem(LEASE_KEY.format(name=account.name), token)
+    except Exception as e:
+        print(f"⚠️ Could not release lease on account {account.name}: {e}")
+
+
+@asynccontextmanager
+async def lease(script_url: str, prefer: Optional[str] = None, wait: float = ACCOUNT_LEASE_WAIT_SECONDS):
+    """
+    Hold one lease on an account that can manage `script_url` for the duration
+    of the block; `prefer` (e.g. the account the scheduler took a token for) is
+    tried first. Raises SessionExpiredError if no healthy account can manage the
+    script, TransientError if all of them stay busy for `wait` seconds.
+    """
+    token = uuid.uuid4().hex
+    deadline = time.monotonic() + wait
+    delay = 0.25
+    while True:
+        names = accounts_for(script_url)
+        if not names:
+            raise SessionExpiredError(f"No healthy TradingView account can manage {script_url}")
+        if prefer in names:
+            names.remove(prefer)
+            names.insert(0, prefer)
+        account = next((get_account(n) for n in names if _try_lease(get_account(n), token)), None)
+        if account is not None:
+            break
+        if time.monotonic() >= deadline:
+            raise TransientError(f"All accounts for {script_url} busy for {wait:.0f}s")
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 5)
+
+    renewer = asyncio.create_task(_renew(account, token))
+    try:
+        yield account
+    finally:
+        renewer.cancel()
+        _release(account, token)
+
+
+# ---------- storage_state cache ----------
+def cached_state(account: Account) -> Optional[dict]:
+    try:
+        raw = get_redis().get(STATE_KEY.format(name=account.name))
+        return json.loads(raw) if raw else None
+    except Exception:
+        return None
+
+
+async def save_state(account: Account, context):
+    """Cache the context's storage_state for the next context on this account."""
+    try:
+        state = await context.storage_state()
+        get_redis().set(STATE_KEY.format(name=account.name), json.dumps(state), ex=ACCOUNT_STATE_TTL_SECONDS)
+    except Exception as e:
+        print(f"⚠️ Could not cache storage_state for account {account.name}: {e}")
+
+
+if __name__ == "__main__":
+    for name, ok in run_health_checks().items():
+        print(f"{'✅' if ok else '❌' if ok is False else '❔'} {name}")
@@ -0,0 +1,179 @@
+# artifacts.py
+"""
+Failure artifacts (screenshots / Playwright traces), kept off the critical path.
+
+Only failures are captured by default. Screenshots are viewport JPEGs taken
+into memory; writing them to the store happens in a thread so the flow never
+waits on disk. The local store is a capped ring buffer (oldest files are
+deleted first) and stands in for an object store. Every artifact is indexed
+in Redis under the task ID that produced it.
+
+ARTIFACT_MODE:
+  screenshot - JPEG of the viewport when a step fails (default)
+  trace      - Playwright trace per grant, kept only if the grant failed
+  off        - nothing
+ARTIFACT_DEBUG=1 also captures before/after the Grant click, like the old
+debug_before_grant_*.png files.
+"""
+import os
+import re
+import time
+import json
+import asyncio
+import shutil
+import tempfile
+from contextvars import ContextVar
+from typing import Optional
+
+ARTIFACT_MODE = os.getenv("ARTIFACT_MODE", "screenshot").lower()
+ARTIFACT_DEBUG = os.getenv("ARTIFACT_DEBUG", "0") == "1"
+ARTIFACT_DIR = os.getenv("ARTIFACT_DIR", os.path.join(tempfile.gettempdir(), "tvab-artifacts"))
+ARTIFACT_MAX_FILES = int(os.getenv("ARTIFACT_MAX_FILES", "200"))
+ARTIFACT_MAX_MB = int(os.getenv("ARTIFACT_MAX_MB", "100"))
+ARTIFACT_JPEG_QUALITY = int(os.getenv("ARTIFACT_JPEG_QUALITY", "50"))
+
+INDEX_KEY = "grant:artifacts"                 # newest-first list of all artifacts (capped)
+TASK_INDEX_KEY = "grant:artifacts:{task_id}"  # artifacts of one task
+INDEX_TTL_SECONDS = 7 * 24 * 3600
+
+# Set by the worker around each task so deep code can tag artifacts
+current_task_id: ContextVar[Optional[str]] = ContextVar("current_task_id", default=None)
+
+# Background writes still in flight (kept referenced until done)
+_pending = set()
+
+
+class LocalRingStore:
+    """Directory capped by file count and total size; oldest artifacts are evicted first."""
+
+    def __init__(self, root: str = ARTIFACT_DIR, max_files: int = ARTIFACT_MAX_FILES, max_mb: int = ARTIFACT_MAX_MB):
+        self.root = root
+        self.max_files = max_files
+        self.max_bytes = max_mb * 1024 * 1024
+
+    def put(self, name: str, data: bytes) -> str:
+        os.makedirs(self.root, exist_ok=True)
+        path = os.path.join(self.root, name)
+        with open(path, "wb") as f:
+            f.write(data)
+        self._prune()
+        return path
+
+    def put_file(self, name: str, src: str) -> str:
+        os.makedirs(self.root, exist_ok=True)
+        path = os.path.join(self.root, name)
+        shutil.move(src, path)
+        self._prune()
+        return path
+
+    def _prune(self):
+        entries = []
+        for entry in os.scandir(self.root):
+            if entry.is_file():
+                st = entry.stat()
+                entries.append((st.st_mtime, st.st_size, entry.path))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        while entries and (len(entries) > self.max_files or total > self.max_bytes):
+            _, size, path = entries.pop(0)
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+
+store = LocalRingStore()
+
+
+def _safe(text: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]+", "_", text)[:60]
+
+
+def _index(task_id: str, record: dict):
+    try:
+        from redis_client import get_redis
+        r = get_redis()
+        raw = json.dumps(record)
+        pipe = r.pipeline(transaction=False)
+        pipe.lpush(INDEX_KEY, raw)
+        pipe.ltrim(INDEX_KEY, 0, ARTIFACT_MAX_FILES - 1)
+        key = TASK_INDEX_KEY.format(task_id=task_id)
+        pipe.rpush(key, raw)
+        pipe.expire(key, INDEX_TTL_SECONDS)
+        pipe.execute()
+    except Exception as e:
+        print(f"⚠️ Could not index artifact: {e}")
+
+
+def _store_and_index(name: str, data: Optional[bytes], src: Optional[str], record: dict):
+    try:
+        record["path"] = store.put(name, data) if data is not None else store.put_file(name, src)
+    except Exception as e:
+        print(f"⚠️ Could not store artifact {name}: {e}")
+        return
+    _index(record["task_id"], record)
+    print(f"🗂️ Artifact saved: {record['path']}")
+
+
+def _in_background(name: str, record: dict, data: Optional[bytes] = None, src: Optional[str] = None):
+    loop = asyncio.get_running_loop()
+    fut = loop.run_in_executor(None, _store_and_index, name, data, src, record)
+    _pending.add(fut)
+    fut.add_done_callback(_pending.discard)
+
+
+def _record(kind: str, label: str, username: str) -> tuple:
+    task_id = current_task_id.get() or "local"
+    ts = time.strftime("%Y%m%dT%H%M%S")
+    name = f"{ts}_{_safe(task_id)}_{_safe(label)}_{_safe(username)}"
+    record = {"task_id": task_id, "kind": kind, "label": label, "username": username, "ts": time.time()}
+    return name, record
+
+
+async def capture_failure(page, label: str, username: str):
+    """Viewport JPEG of the page as it failed; stored in the background."""
+    if ARTIFACT_MODE != "screenshot":
+        return
+    try:
+        data = await page.screenshot(type="jpeg", quality=ARTIFACT_JPEG_QUALITY, full_page=False, timeout=5000)
+    except Exception as e:
+        print(f"⚠️ Failure screenshot skipped: {e}")
+        return
+    name, record = _record("screenshot", label, username)
+    _in_background(name + ".jpg", record, data=data)
+
+
+async def capture_debug(page, label: str, username: str):
+    """Opt-in (ARTIFACT_DEBUG=1) capture on the success path."""
+    if ARTIFACT_DEBUG:
+        await capture_failure(page, label, username)
+
+
+async def start_trace(context):
+    if ARTIFACT_MODE == "trace":
+        await context.tracing.start(screenshots=True, snapshots=True)
+
+
+async def finish_trace(context, failed: bool, label: str, username: str):
+    """Keep the trace only for failed grants."""
+    if ARTIFACT_MODE != "trace":
+        return
+    try:
+        if not failed:
+            await context.tracing.stop()
+            return
+        fd, tmp = tempfile.mkstemp(suffix=".zip")
+        os.close(fd)
+        await context.tracing.stop(path=tmp)
+    except Exception as e:
+        print(f"⚠️ Could not stop trace: {e}")
+        return
+    name, record = _record("trace", label, username)
+    _in_background(name + ".zip", record, src=tmp)
+
+
+def list_artifacts(task_id: str) -> list:
+    """Artifacts recorded for one task (oldest first)."""
+    from redis_client import get_redis
+    return [json.loads(x) for x in get_redis().lrange(TASK_INDEX_KEY.format(task_id=task_id), 0, -1)]
@@ -0,0 +1,191 @@
+# async_worker.py
+"""
+asyncio-native grant worker: one event loop and one shared Chromium per
+process, running up to ASYNC_WORKER_CONCURRENCY grants at once, each in its
+own BrowserContext.
+
+Jobs come from the `grant:jobs` list on the broker Redis (see dispatch.py,
+GRANT_WORKER_MODE=asyncio). A job is moved to a per-dyno processing list
+while it runs, so jobs interrupted by a crash are re-queued on the next start.
+SIGTERM stops pulling new jobs and drains the in-flight ones.
+
+    python async_worker.py
+"""
+import os
+import json
+import time
+import signal
+import socket
+import asyncio
+import redis.asyncio as aioredis
+from browser_pool import BrowserPool
+from dispatch import JOBS_KEY, DELAYED_KEY, take_pending, retry_failed, retry_grant
+from grant_access import (
+    grant_access, grant_access_many, update_expiration, close_backends, PLAYWRIGHT_HEADLESS, CHROMIUM_ARGS,
+)
+from redis_client import BROKER_URL
+from metrics import observe
+from grant_errors import classify, should_retry
+from artifacts import current_task_id
+import grant_status
+from account_pool import check_due
+
+ASYNC_WORKER_CONCURRENCY = int(os.getenv("ASYNC_WORKER_CONCURRENCY", "8"))
+# Heroku sends SIGKILL 30 s after SIGTERM
+ASYNC_WORKER_DRAIN_SECONDS = float(os.getenv("ASYNC_WORKER_DRAIN_SECONDS", "25"))
+
+WORKER_ID = os.getenv("DYNO") or socket.gethostname()
+PROCESSING_KEY = f"{JOBS_KEY}:processing:{WORKER_ID}"
+
+
+async def run_job(job: dict, pool: BrowserPool):
+    kind = job.get("type", "grant")
+    if job.get("enqueued_at"):
+        observe("tvab_queue_lag_seconds", max(0.0, time.time() - job["enqueued_at"]), worker="asyncio")
+    if kind == "grant":
+        try:
+            await grant_access(
+                job["username"], job["script_url"], job.get("trial_end_gmt"),
+                pool=pool, raise_on_error=True, account=job.get("account"), grant_id=job.get("grant_id"),
+            )
+        except Exception as e:
+            err = classify(e)
+            retries = job.get("retries", 0)
+            if should_retry(err, retries):
+                retry_grant(job["username"], job["script_url"], job.get("trial_end_gmt"), err.kind, retries,
+                            job.get("grant_id"))
+            else:
+                print(f"❌ Giving up on {job['username']} ({err.kind} at step {err.step}): {err}")
+                if err.retryable:
+                    # grant_access left the record open for a retry that won't come
+                    grant_status.give_up(job.get("grant_id"), str(err), err.kind)
+    elif kind == "flush":
+        grants = take_pending(job["script_url"])
+        if grants:
+            results = await grant_access_many(job["script_url"], grants, pool=pool)
+            retry_failed(job["script_url"], grants, results)
+    elif kind == "expiry":
+        await update_expiration(job["username"], job["script_url"], job.get("trial_end_gmt"))
+    else:
+        print(f"⚠️ Unknown job type {kind!r}: {job}")
+
+
+# Move due jobs from the delayed ZSET to the front of the job list, atomically
+PROMOTE_DUE_LUA = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, 100)
+for _, job in ipairs(due) do
+    redis.call('ZREM', KEYS[1], job)
+    redis.call('RPUSH', KEYS[2], job)
+end
+return #due
+"""
+
+
+class AsyncGrantWorker:
+    def __init__(self, concurrency: int = ASYNC_WORKER_CONCURRENCY):
+        kwargs = {"decode_responses": True}
+        if BROKER_URL.startswith("rediss://"):
+            kwargs["ssl_cert_reqs"] = None
+        self.redis = aioredis.Redis.from_url(BROKER_URL, **kwargs)
+        self.pool = BrowserPool(headless=PLAYWRIGHT_HEADLESS, args=CHROMIUM_ARGS)
+        self.concurrency = concurrency
+        self.slots = asyncio.Semaphore(concurrency)
+        self.stopping = asyncio.Event()
+        self.inflight = set()
+        self.promote_due = self.redis.register_script(PROMOTE_DUE_LUA)
+
+    async def requeue_orphans(self):
+        """Put back jobs this dyno was running when it last died."""
+        moved = 0
+        while await self.redis.lmove(PROCESSING_KEY, JOBS_KEY, "RIGHT", "RIGHT"):
+            moved += 1
+        if moved:
+            print(f"♻️ Re-queued {moved} interrupted jobs")
+
+    async def _run(self, raw: str):
+        cancelled = False
+        try:
+            job = json.loads(raw)
+            current_task_id.set(job.get("id"))
+            await run_job(job, self.pool)
+        except asyncio.CancelledError:
+            # Cut off by shutdown: stays in the processing list for the next start
+            cancelled = True
+            raise
+        except Exception as e:
+            print(f"❌ Job failed: {e}")
+        finally:
+            if not cancelled:
+                await self.redis.lrem(PROCESSING_KEY, 1, raw)
+            self.slots.release()
+
+    async def health_checks(self):
+        """Periodic account session checks (the first process per interval does the work)."""
+        loop = asyncio.get_running_loop()
+        while not self.stopping.is_set():
+            try:
+                await loop.run_in_executor(None, check_due)
+            except Exception as e:
+                print(f"⚠️ Account health check failed: {e}")
+            try:
+                await asyncio.wait_for(self.stopping.wait(), timeout=60)
+            except asyncio.TimeoutError:
+                pass
+
+    async def acquire_slot(self) -> bool:
+        """Wait for a free slot; False as soon as the worker is stopping (no waiting for a grant to end)."""
+        acquire = asyncio.create_task(self.slots.acquire())
+        stop = asyncio.create_task(self.stopping.wait())
+        await asyncio.wait({acquire, stop}, return_when=asyncio.FIRST_COMPLETED)
+        stop.cancel()
+        if not acquire.done():
+            acquire.cancel()
+            await asyncio.gather(acquire, return_exceptions=True)
+            return False
+        if self.stopping.is_set():
+            self.slots.release()
+            return False
+        return True
+
+    async def serve(self):
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, self.stopping.set)
+
+        await self.requeue_orphans()
+        await self.pool.start()
+        print(f"🚀 Async grant worker {WORKER_ID} up (concurrency={self.concurrency})")
+        health = asyncio.create_task(self.health_checks())
+
+        # Backpressure: only pull a job when a slot is free
+        while await self.acquire_slot():
+            await self.promote_due(keys=[DELAYED_KEY, JOBS_KEY], args=[time.time()])
+            raw = await self.redis.blmove(JOBS_KEY, PROCESSING_KEY, 1, "RIGHT", "LEFT")
+            if raw is None:
+                self.slots.release()
+                continue
+            task = asyncio.create_task(self._run(raw))
+            self.inflight.add(task)
+            task.add_done_callback(self.inflight.discard)
+
+        await health
+        await self.drain()
+
+    async def drain(self):
+        if self.inflight:
+            print(f"⏳ Draining {len(self.inflight)} in-flight grants...")
+            done, pending = await asyncio.wait(self.inflight, timeout=ASYNC_WORKER_DRAIN_SECONDS)
+            if pending:
+                # Left in the processing list; re-queued on next start
+                print(f"⚠️ {len(pending)} grants still running at shutdown")
+                for t in pending:
+                    t.cancel()
+                await asyncio.gather(*pending, return_exceptions=True)
+        await self.pool.stop()
+        await close_backends()
+        await self.redis.aclose()
+        print("👋 Async grant worker stopped")
+
+
+if __name__ == "__main__":
+    asyncio.run(AsyncGrantWorker().serve())
@@ -0,0 +1,168 @@
+# bench_grant.py
+"""
+End-to-end grant benchmark against the local mock TradingView site.
+
+    python bench_grant.py --grants 40 --concurrency 1,2,4,8 --variant a
+
+Runs the real grant_access flow on a shared BrowserPool and reports, per
+concurrency level: p50/p95 seconds for each step (goto through
+click_grant_access), total grants/minute, failures and peak RSS of this
+process plus Chromium.
+
+Grants are recorded in the grant ledger like any other run; use a local
+Redis (or none) rather than the production REDIS_URL.
+"""
+import os
+import time
+import uuid
+import asyncio
+import argparse
+import statistics
+from collections import defaultdict
+
+# The mock ignores cookies, but grant_access refuses to start without them
+os.environ.setdefault("TRADINGVIEW_SESSIONID", "bench")
+os.environ.setdefault("TRADINGVIEW_ECUID", "bench")
+
+import grant_access as ga
+from browser_pool import BrowserPool, process_tree_rss_mb
+from mock_tradingview import start_mock_server
+
+STEPS = [
+    ("goto", "_goto_script"),
+    ("dialog", "open_manage_access_dialog"),
+    ("tab", "switch_to_add_new_users_tab"),
+    ("search", "search_and_add_user"),
+    ("expiry", "set_expiration_date"),
+    ("grant", "click_grant_access"),
+]
+
+
+def instrument(timings: dict):
+    """Wrap the step functions in grant_access so every call records its duration."""
+    originals = {}
+    for label, name in STEPS:
+        fn = getattr(ga, name)
+        originals[name] = fn
+
+        async def wrapped(*args, _fn=fn, _label=label, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return await _fn(*args, **kwargs)
+            finally:
+                timings[_label].append(time.perf_counter() - t0)
+
+        setattr(ga, name, wrapped)
+    return originals
+
+
+def restore(originals: dict):
+    for name, fn in originals.items():
+        setattr(ga, name, fn)
+
+
+def pct(values, q):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+async def sample_rss(stop: asyncio.Event, peak: list):
+    while not stop.is_set():
+        peak[0] = max(peak[0], process_tree_rss_mb())
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=0.5)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def run_level(pool, script_url: str, grants: int, concurrency: int) -> dict:
+    timings = defaultdict(list)
+    originals = instrument(timings)
+    slots = asyncio.Semaphore(concurrency)
+    run_id = uuid.uuid4().hex[:6]
+    peak, stop = [0.0], asyncio.Event()
+    sampler = asyncio.create_task(sample_rss(stop, peak))
+
+    async def one(i):
+        async with slots:
+            return await ga.grant_access(f"bench_{run_id}_{i}", script_url, None, pool=pool)
+
+    t0 = time.perf_counter()
+    try:
+        results = await asyncio.gather(*(one(i) for i in range(grants)), return_exceptions=True)
+    finally:
+        elapsed = time.perf_counter() - t0
+        stop.set()
+        await sampler
+        restore(originals)
+
+    return {
+        "concurrency": concurrency,
+        "ok": sum(r is True for r in results),
+        "failed": sum(r is not True for r in results),
+        "grants_per_min": grants / elapsed * 60,
+        "peak_rss_mb": peak[0],
+        "steps": {label: (pct(v, 0.5), pct(v, 0.95)) for label, v in timings.items()},
+    }
+
+
+def print_report(rows):
+    labels = [label for label, _ in STEPS]
+    header = f"{'conc':>4} {'ok':>4} {'fail':>4} {'grants/min':>10} {'peak MB':>8}  " + "  ".join(
+        f"{label + ' p50/p95':>17}" for label in labels
+    )
+    print(header)
+    for r in rows:
+        cells = []
+        for label in labels:
+            p50, p95 = r["steps"].get(label, (float("nan"), float("nan")))
+            cells.append(f"{p50:>8.2f}/{p95:<8.2f}")
+        print(
+            f"{r['concurrency']:>4} {r['ok']:>4} {r['failed']:>4} {r['grants_per_min']:>10.1f} "
+            f"{r['peak_rss_mb']:>8.0f}  " + "  ".join(cells)
+        )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Grant-flow benchmark on the mock TradingView site")
+    parser.add_argument("--grants", type=int, default=20, help="grants per concurrency level")
+    parser.add_argument("--concurrency", default="1,2,4", help="comma-separated levels")
+    parser.add_argument("--variant", choices=["a", "b"], default="a")
+    parser.add_argument("--search-delay", type=int, default=300)
+    parser.add_argument("--grant-delay", type=int, default=400)
+    parser.add_argument("--dialog-delay", type=int, default=150)
+    parser.add_argument("--backends", default=",".join(ga.GRANT_BACKENDS),
+                        help='e.g. "http,playwright" (browser step columns stay empty for HTTP grants)')
+    args = parser.parse_args()
+    ga.GRANT_BACKENDS = [b.strip() for b in args.backends.split(",") if b.strip()]
+
+    server, _, base_url = start_mock_server(
+        variant=args.variant,
+        search_delay_ms=args.search_delay,
+        grant_delay_ms=args.grant_delay,
+        dialog_delay_ms=args.dialog_delay,
+    )
+    script_url = f"{base_url}/script/abc123-bench/"
+    print(f"🧪 Mock TradingView at {script_url} (variant {args.variant}, wait mode {ga.GRANT_WAIT_MODE}, "
+          f"page profile {ga.GRANT_PAGE_PROFILE}, backends {','.join(ga.GRANT_BACKENDS)})")
+
+    pool = BrowserPool(headless=ga.PLAYWRIGHT_HEADLESS, args=ga.CHROMIUM_ARGS)
+    await pool.start()
+    rows = []
+    try:
+        for level in (int(c) for c in args.concurrency.split(",")):
+            rows.append(await run_level(pool, script_url, args.grants, level))
+    finally:
+        await pool.stop()
+        await ga.close_backends()
+        server.shutdown()
+    print_report(rows)
+    total = [r["grants_per_min"] for r in rows]
+    if total:
+        print(f"best throughput: {max(total):.1f} grants/min; median across levels {statistics.median(total):.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,112 @@
+# bench_page_profile.py
+"""
+Compare the "full" and "lean" page-load profiles on a script page.
+
+Usage:
+    python bench_page_profile.py https://www.tradingview.com/script/XXXX/ [--runs 5]
+    python bench_page_profile.py --mock [--image-delay 150] [--runs 5]
+
+For each profile, measures bytes transferred (request bodies + response
+bodies/headers as reported by Chromium) and time from goto() until the
+"Add new users" tab of the Manage access dialog is visible. Uses the
+first configured account (TRADINGVIEW_ACCOUNTS, or TRADINGVIEW_SESSIONID /
+TRADINGVIEW_ECUID) like the worker does.
+
+--mock runs against mock_tradingview.py instead (no account needed): its
+script page carries `heavy_images` ~200 KB images, each served after
+--image-delay ms, so the difference is reproducible locally.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from playwright.async_api import async_playwright
+from grant_access import (
+    CHROMIUM_ARGS,
+    PLAYWRIGHT_HEADLESS,
+    _session_cookies,
+    apply_page_profile,
+    wait_page_ready,
+    open_manage_access_dialog,
+)
+from mock_tradingview import start_mock_server
+
+
+async def measure(browser, script_url: str, profile: str, cookies: list) -> dict:
+    context = await browser.new_context()
+    try:
+        if cookies:
+            await context.add_cookies(cookies)
+        await apply_page_profile(context, profile)
+        page = await context.new_page()
+
+        finished = []
+        page.on("requestfinished", lambda req: finished.append(req))
+        blocked = []
+        page.on("requestfailed", lambda req: blocked.append(req))
+
+        t0 = time.perf_counter()
+        await page.goto(script_url, wait_until="domcontentloaded" if profile == "lean" else "load", timeout=30_000)
+        await wait_page_ready(page, profile)
+        await open_manage_access_dialog(page, "bench")
+        await page.locator("[role='tab']:has-text('Add new users')").first.wait_for(state="visible", timeout=15_000)
+        elapsed = time.perf_counter() - t0
+
+        total = 0
+        for req in finished:
+            try:
+                sizes = await req.sizes()
+                total += sizes["requestBodySize"] + sizes["responseBodySize"] + sizes["responseHeadersSize"]
+            except Exception:
+                pass
+        return {"seconds": elapsed, "bytes": total, "requests": len(finished), "blocked": len(blocked)}
+    finally:
+        await context.close()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("script_url", nargs="?")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--mock", action="store_true", help="benchmark against a local mock_tradingview server")
+    parser.add_argument("--image-delay", type=int, default=150, help="--mock: ms before each heavy image is served")
+    args = parser.parse_args()
+    if args.mock == bool(args.script_url):
+        parser.error("give either a script URL or --mock")
+
+    server = None
+    if args.mock:
+        server, _, base_url = start_mock_server(image_delay_ms=args.image_delay)
+        script_url, cookies = f"{base_url}/script/abc123-demo/", []
+        print(f"🧪 Mock TradingView on {script_url}")
+    else:
+        script_url, cookies = args.script_url, _session_cookies()
+
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(headless=PLAYWRIGHT_HEADLESS, args=CHROMIUM_ARGS)
+        try:
+            print(f"{'profile':<8} {'p50 s':>8} {'max s':>8} {'MB':>8} {'reqs':>6} {'blocked':>8}")
+            for profile in ("full", "lean"):
+                runs = []
+                for _ in range(args.runs):
+                    try:
+                        runs.append(await measure(browser, script_url, profile, cookies))
+                    except Exception as e:
+                        print(f"⚠️ {profile} run failed: {e}")
+                if not runs:
+                    continue
+                secs = [r["seconds"] for r in runs]
+                print(
+                    f"{profile:<8} {statistics.median(secs):>8.2f} {max(secs):>8.2f} "
+                    f"{statistics.median(r['bytes'] for r in runs) / 1e6:>8.2f} "
+                    f"{int(statistics.median(r['requests'] for r in runs)):>6} "
+                    f"{int(statistics.median(r['blocked'] for r in runs)):>8}"
+                )
+        finally:
+            await browser.close()
+            if server is not None:
+                server.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,103 @@
+# bench_webhook.py
+"""
+Requests/sec of one web worker on /webhook, for both payload shapes.
+
+    python bench_webhook.py --requests 5000 --mode sync,async
+    python bench_webhook.py --no-redis      # parsing/extraction only
+
+Drives the Flask app in-process through its test client (no gunicorn, no
+network), so the numbers are the per-request cost of one worker thread.
+Needs a local Redis unless --no-redis; every request uses a fresh username
+so dedup never short-circuits it.
+"""
+import json
+import time
+import argparse
+import statistics
+
+import ingest
+import webhook_server
+
+
+def simple_payload(i: int) -> dict:
+    return {
+        "tradingview_username": f"bench_user_{i}",
+        "tradingview_script_url": "https://www.tradingview.com/script/abc123-bench/",
+        "trial_end_date_gmt": "2026-12-31T23:59:59",
+    }
+
+
+def woocommerce_payload(i: int) -> dict:
+    """Roughly the size and shape of a WooCommerce Subscriptions webhook (~15 KB)."""
+    filler = [{"id": n, "key": f"_meta_{n}", "value": "x" * 40} for n in range(60)]
+    return {
+        "id": 10_000 + i,
+        "status": "active",
+        "currency": "USD",
+        "billing": {"first_name": "Bench", "last_name": "User", "email": f"bench{i}@example.com",
+                    "address_1": "1 Main St", "city": "Tel Aviv", "country": "IL"},
+        "shipping": {"first_name": "", "last_name": "", "address_1": "", "city": "", "country": ""},
+        "trial_end_date_gmt": "2026-12-31T23:59:59",
+        "meta_data": filler + [{"id": 999, "key": "tradingview_username", "value": f"bench_user_{i}"}],
+        "line_items": [
+            {
+                "id": n, "name": f"Indicator {n}", "quantity": 1, "total": "49.00",
+                "meta_data": filler[:20] + ([{"id": 1000, "key": "tradingview_script_url",
+                                              "value": "https://www.tradingview.com/script/abc123-bench/"}]
+                                            if n == 2 else []),
+            }
+            for n in range(3)
+        ],
+    }
+
+
+SHAPES = {"simple": simple_payload, "woocommerce": woocommerce_payload}
+
+
+def run(client, shape: str, n: int) -> dict:
+    bodies = [json.dumps(SHAPES[shape](i) | {"_bench": time.time_ns()}) for i in range(n)]
+    latencies = []
+    t0 = time.perf_counter()
+    for body in bodies:
+        t = time.perf_counter()
+        resp = client.post("/webhook", data=body, content_type="application/json")
+        latencies.append((time.perf_counter() - t) * 1000)
+        if resp.status_code >= 400:
+            raise SystemExit(f"{shape}: HTTP {resp.status_code} {resp.get_data(as_text=True)}")
+    elapsed = time.perf_counter() - t0
+    latencies.sort()
+    return {
+        "rps": n / elapsed,
+        "p50": statistics.median(latencies),
+        "p99": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+        "bytes": len(bodies[0]),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Webhook ingestion micro-benchmark")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--mode", default="sync,async", help="comma-separated: sync, async")
+    parser.add_argument("--no-redis", action="store_true", help="skip dedup/status/enqueue/push (parsing cost only)")
+    args = parser.parse_args()
+
+    if args.no_redis:
+        ingest.claim_webhook = lambda *a: True
+        ingest.enqueue_grant = lambda *a, **kw: None
+        ingest.grant_status.create = lambda *a, **kw: None
+        ingest.grant_status.reject = lambda *a, **kw: None
+        webhook_server.push_raw = lambda raw: None
+    ingest.print = lambda *a, **kw: None   # per-request log lines would dominate
+
+    client = webhook_server.app.test_client()
+    print(f"JSON parser: {ingest.loads.__module__}; redis: {'off' if args.no_redis else 'on'}")
+    print(f"{'mode':>6} {'shape':>12} {'bytes':>7} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8}")
+    for mode in args.mode.split(","):
+        webhook_server.WEBHOOK_INGEST_MODE = mode
+        for shape in SHAPES:
+            r = run(client, shape, args.requests)
+            print(f"{mode:>6} {shape:>12} {r['bytes']:>7} {r['rps']:>9.0f} {r['p50']:>8.3f} {r['p99']:>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+# browser_pool.py
+import os
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Optional
+from playwright.async_api import async_playwright
+from metrics import span
+
+# ---------- Pool config ----------
+# Recycle the browser after this many contexts, or when Chromium + this process exceed the RSS limit.
+BROWSER_POOL_MAX_CONTEXTS = int(os.getenv("BROWSER_POOL_MAX_CONTEXTS", "50"))
+BROWSER_POOL_MAX_RSS_MB   = int(os.getenv("BROWSER_POOL_MAX_RSS_MB", "700"))
+
+
+def process_tree_rss_mb(pid: Optional[int] = None) -> float:
+    """
+    RSS of `pid` (default: this process) plus all of its descendants, in MB.
+    Chromium runs as child processes, so the worker's own RSS alone hides it.
+    Linux only (/proc); returns 0.0 where /proc is unavailable.
+    """
+    root = pid or os.getpid()
+    children = {}
+    rss_kb = {}
+    try:
+        entries = os.listdir("/proc")
+    except OSError:
+        return 0.0
+
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                stat = f.read()
+            with open(f"/proc/{entry}/statm") as f:
+                resident_pages = int(f.read().split()[1])
+        except (OSError, ValueError, IndexError):
+            continue
+        # comm may contain spaces/parens; ppid is the 2nd field after the last ')'
+        ppid = int(stat.rsplit(")", 1)[1].split()[1])
+        children.setdefault(ppid, []).append(int(entry))
+        rss_kb[int(entry)] = resident_pages * (os.sysconf("SC_PAGE_SIZE") // 1024)
+
+    total, stack = 0, [root]
+    while stack:
+        p = stack.pop()
+        total += rss_kb.get(p, 0)
+        stack.extend(children.get(p, []))
+    return total / 1024
+
+
+class BrowserPool:
+    """
+    One long-lived Chromium per worker process.
+
+    Each caller gets a fresh BrowserContext (isolated cookies/storage) from
+    `context()`. After `max_contexts` contexts, or when the process tree RSS
+    goes above `max_rss_mb`, a new browser is launched for subsequent callers
+    and the old one is closed once its last context is released.
+    """
+
+    def __init__(
+        self,
+        headless: bool = True,
+        args: Optional[list] = None,
+        max_contexts: int = BROWSER_POOL_MAX_CONTEXTS,
+        max_rss_mb: int = BROWSER_POOL_MAX_RSS_MB,
+    ):
+        self.headless = headless
+        self.args = args or []
+        self.max_contexts = max_contexts
+        self.max_rss_mb = max_rss_mb
+
+        self._playwright = None
+        self._browser = None
+        self._served = 0          # contexts handed out by the current browser
+        self._active = {}         # browser -> open contexts
+        self._lock = asyncio.Lock()
+
+    async def start(self):
+        async with self._lock:
+            if self._playwright is None:
+                self._playwright = await async_playwright().start()
+            if self._browser is None:
+                await self._launch()
+
+    async def stop(self):
+        async with self._lock:
+            for browser in list(self._active):
+                await self._close_browser(browser)
+            self._browser = None
+            if self._playwright is not None:
+                await self._playwright.stop()
+                self._playwright = None
+
+    async def _launch(self):
+        print("🚀 Launching pooled Chromium...")
+        with span("launch"):
+            self._browser = await self._playwright.chromium.launch(headless=self.headless, args=self.args)
+        self._active[self._browser] = 0
+        self._served = 0
+
+    async def _close_browser(self, browser):
+        self._active.pop(browser, None)
+        try:
+            await browser.close()
+        except Exception as e:
+            print(f"⚠️ Error closing pooled browser: {e}")
+
+    def _needs_recycle(self) -> bool:
+        if self._browser is None or not self._browser.is_connected():
+            return True
+        if self._served >= self.max_contexts:
+            print(f"♻️ Recycling browser after {self._served} contexts")
+            return True
+        if self.max_rss_mb and process_tree_rss_mb() > self.max_rss_mb:
+            print(f"♻️ Recycling browser: RSS above {self.max_rss_mb} MB")
+            return True
+        return False
+
+    async def _acquire_browser(self):
+        async with self._lock:
+            if self._playwright is None:
+                self._playwright = await async_playwright().start()
+            if self._needs_recycle():
+                old = self._browser
+                await self._launch()
+                # Retire the old browser now if idle, otherwise on its last release
+                if old is not None and self._active.get(old, 0) == 0:
+                    await self._close_browser(old)
+            self._served += 1
+            self._active[self._browser] += 1
+            return self._browser
+
+    async def _release_browser(self, browser):
+        async with self._lock:
+            if browser not in self._active:
+                return
+            self._active[browser] -= 1
+            if browser is not self._browser and self._active[browser] == 0:
+                await self._close_browser(browser)
+
+    @asynccontextmanager
+    async def context(self, **context_kwargs):
+        """Yield a fresh BrowserContext on the pooled browser; closed on exit."""
+        browser = await self._acquire_browser()
+        try:
+            with span("context"):
+                context = await browser.new_context(**context_kwargs)
+            try:
+                yield context
+            finally:
+                try:
+                    await context.close()
+                except Exception:
+                    pass
+        finally:
+            await self._release_browser(browser)
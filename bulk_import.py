@@ -0,0 +1,253 @@
+# bulk_import.py
+"""
+Grant thousands of (username, script_url, expiry) rows from a file.
+
+    python bulk_import.py partner.csv --in-flight 200 --batch-size 20
+
+Input is CSV (tradingview_username / username, tradingview_script_url /
+script_url, trial_end_date_gmt / expiry columns) or JSONL with the same keys.
+The file is streamed and every row is queued for the regular workers, so
+imports share accounts fairly with live grants instead of leasing them from
+a browser pool of their own:
+  * with GRANT_SCHEDULER, through the backfill lane (and its token buckets)
+  * otherwise as --batch-size batches per script (dispatch.submit_batch)
+Each row gets a grant_status record (id = its row key); at most --in-flight
+rows are queued at a time, and their records are polled for the outcome.
+
+Every finished row is appended to the journal (default <input>.journal.jsonl).
+Re-running the same command resumes: rows already granted, skipped or failed
+for good are not tried again (--retry-failed retries the failures too), and
+rows still queued from the interrupted run are only waited for.
+A report of successes, failures and skips is written at the end.
+"""
+import os
+import csv
+import json
+import time
+import hashlib
+import argparse
+from typing import Optional
+from grant_ledger import normalize_username
+from grant_errors import RETRY_POLICY
+from dispatch import GRANT_SCHEDULER, submit_batch
+from scheduler import enqueue_scheduled
+import grant_status
+
+PROGRESS_EVERY_SECONDS = 10
+POLL_SECONDS = 2
+
+
+def row_key(username: str, script_url: str, trial_end_gmt: Optional[str]) -> str:
+    raw = f"{script_url}|{normalize_username(username)}|{trial_end_gmt or ''}"
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+def _field(row: dict, *names) -> Optional[str]:
+    for name in names:
+        if row.get(name):
+            return str(row[name]).strip()
+    return None
+
+
+def read_rows(path: str):
+    """Yield (username, script_url, trial_end_gmt) tuples, streaming."""
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        rows = csv.DictReader(f) if path.endswith(".csv") else (json.loads(line) for line in f if line.strip())
+        for row in rows:
+            yield (
+                _field(row, "tradingview_username", "username"),
+                _field(row, "tradingview_script_url", "script_url"),
+                _field(row, "trial_end_date_gmt", "trial_end_gmt", "expiry"),
+            )
+
+
+def count_rows(path: str) -> int:
+    with open(path, encoding="utf-8-sig") as f:
+        lines = sum(1 for line in f if line.strip())
+    return lines - 1 if path.endswith(".csv") else lines
+
+
+class Journal:
+    """Append-only JSONL of finished rows; the last entry per row wins."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue   # torn last line from a killed run
+                    self.entries[entry["key"]] = entry
+        self._f = open(path, "a", encoding="utf-8")
+
+    def done(self, key: str, retry_failed: bool = False) -> bool:
+        entry = self.entries.get(key)
+        if entry is None:
+            return False
+        if entry["status"] == "failed":
+            return not (retry_failed or entry.get("retryable"))
+        return True
+
+    def append(self, entries: list):
+        for entry in entries:
+            self.entries[entry["key"]] = entry
+            self._f.write(json.dumps(entry) + "\n")
+        self._f.flush()
+
+    def close(self):
+        self._f.close()
+
+
+class Progress:
+    def __init__(self, total: int):
+        self.total = total
+        self.counts = {"ok": 0, "skipped": 0, "failed": 0, "resumed": 0, "invalid": 0}
+        self.t0 = time.monotonic()
+        self.last = 0.0
+
+    def add(self, status: str, n: int = 1):
+        self.counts[status] += n
+        if time.monotonic() - self.last >= PROGRESS_EVERY_SECONDS:
+            self.print()
+
+    def print(self):
+        self.last = time.monotonic()
+        done = sum(self.counts.values())
+        worked = self.counts["ok"] + self.counts["skipped"] + self.counts["failed"]
+        elapsed = max(self.last - self.t0, 1e-6)
+        rate = worked / elapsed * 60
+        eta = (self.total - done) / (rate / 60) if rate else float("inf")
+        eta_text = time.strftime("%H:%M:%S", time.gmtime(eta)) if eta != float("inf") else "?"
+        print(f"📈 {done}/{self.total} rows · {rate:.1f} grants/min · ETA {eta_text} · "
+              + " ".join(f"{k}={v}" for k, v in self.counts.items()))
+
+
+def enqueue(script_url: str, rows: list):
+    """Queue (key, username, trial_end_gmt) rows for the workers, each with its status record."""
+    for key, username, trial_end_gmt in rows:
+        grant_status.create(key, username, script_url, trial_end_gmt)
+    if GRANT_SCHEDULER:
+        for key, username, trial_end_gmt in rows:
+            enqueue_scheduled(username, script_url, trial_end_gmt, lane="backfill", grant_id=key)
+    else:
+        submit_batch(script_url, [(username, trial_end_gmt, key) for key, username, trial_end_gmt in rows])
+
+
+class Importer:
+    def __init__(self, journal: Journal, progress: Progress, in_flight: int):
+        self.journal = journal
+        self.progress = progress
+        self.in_flight = in_flight
+        self.pending = {}   # key -> (username, script_url, trial_end_gmt)
+
+    def _finished(self, key: str, record: dict) -> dict:
+        username, script_url, trial_end_gmt = self.pending.pop(key)
+        status = "skipped" if record.get("skipped") else "ok" if record["state"] == "succeeded" else "failed"
+        self.progress.add(status)
+        return {
+            "key": key, "username": username, "script_url": script_url, "trial_end_gmt": trial_end_gmt,
+            "status": status, "error": record.get("error"), "error_kind": record.get("error_kind"),
+            # Gave up after the workers' retries: worth another run, unlike e.g. user_not_found
+            "retryable": status == "failed" and record.get("error_kind") in RETRY_POLICY, "at": time.time(),
+        }
+
+    def submit(self, script_url: str, rows: list):
+        records = grant_status.get_many([key for key, _, _ in rows])
+        fresh, finished = [], []
+        for (key, username, trial_end_gmt), record in zip(rows, records):
+            self.pending[key] = (username, script_url, trial_end_gmt)
+            if record is not None and not record["final"]:
+                continue   # still queued from an interrupted run
+            if record is not None and key not in self.journal.entries:
+                finished.append(self._finished(key, record))   # finished while we were away
+            else:
+                fresh.append((key, username, trial_end_gmt))
+        self.journal.append(finished)
+        enqueue(script_url, fresh)
+        # Backpressure: don't read further ahead than --in-flight rows
+        while len(self.pending) >= self.in_flight:
+            self.wait()
+
+    def poll(self):
+        keys = list(self.pending)
+        finished = [
+            self._finished(key, record)
+            for key, record in zip(keys, grant_status.get_many(keys))
+            if record is not None and record["final"]
+        ]
+        self.journal.append(finished)
+        return finished
+
+    def wait(self):
+        if not self.poll():
+            time.sleep(POLL_SECONDS)
+
+
+def bulk_import(path: str, journal_path: str, in_flight: int, batch_size: int, retry_failed: bool) -> dict:
+    journal = Journal(journal_path)
+    progress = Progress(count_rows(path))
+    importer = Importer(journal, progress, in_flight)
+    invalid = []
+    buffers = {}
+    try:
+        for line_no, (username, script_url, trial_end_gmt) in enumerate(read_rows(path), start=1):
+            if not username or not script_url:
+                invalid.append(line_no)
+                progress.add("invalid")
+                continue
+            key = row_key(username, script_url, trial_end_gmt)
+            if journal.done(key, retry_failed):
+                progress.add("resumed")
+                continue
+            buf = buffers.setdefault(script_url, [])
+            buf.append((key, username, trial_end_gmt))
+            if len(buf) >= batch_size:
+                importer.submit(script_url, buffers.pop(script_url))
+        for script_url, rows in buffers.items():
+            importer.submit(script_url, rows)
+        while importer.pending:
+            importer.wait()
+    finally:
+        # Interrupted: queued rows keep running on the workers; a resume waits for them
+        journal.close()
+
+    progress.print()
+    rows = list(journal.entries.values())
+    return {
+        "input": path,
+        "journal": journal_path,
+        "counts": {status: sum(e["status"] == status for e in rows) for status in ("ok", "skipped", "failed")},
+        "invalid_lines": invalid,
+        "failures": [
+            {k: e[k] for k in ("username", "script_url", "trial_end_gmt", "error_kind", "error", "retryable")}
+            for e in rows if e["status"] == "failed"
+        ],
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Resumable bulk grant from a CSV or JSONL file")
+    parser.add_argument("input", help=".csv or .jsonl with username, script_url and expiry per row")
+    parser.add_argument("--in-flight", type=int, default=200, help="rows queued on the workers at once")
+    parser.add_argument("--batch-size", type=int, default=20,
+                        help="grants per Manage-access session (without GRANT_SCHEDULER)")
+    parser.add_argument("--journal", help="default: <input>.journal.jsonl")
+    parser.add_argument("--report", help="default: <input>.report.json")
+    parser.add_argument("--retry-failed", action="store_true", help="also retry rows that failed for good")
+    args = parser.parse_args()
+
+    journal_path = args.journal or args.input + ".journal.jsonl"
+    report_path = args.report or args.input + ".report.json"
+    try:
+        report = bulk_import(args.input, journal_path, args.in_flight, args.batch_size, args.retry_failed)
+    except KeyboardInterrupt:
+        print(f"⏸️ Interrupted – run the same command again to resume from {journal_path}")
+        raise SystemExit(130)
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    c = report["counts"]
+    print(f"✅ {c['ok']} granted, {c['skipped']} skipped, {c['failed']} failed, "
+          f"{len(report['invalid_lines'])} invalid rows – report: {report_path}")
@@ -0,0 +1,25 @@
+# celery_app.py
+"""
+The Celery app on its own, without the tasks.
+
+The web tier and dispatch send tasks by name through this app, so they never
+import celery_worker (and with it grant_access / Playwright). The worker
+imports it from celery_worker, where the tasks are registered.
+"""
+from celery import Celery
+from redis_client import BROKER_URL
+
+app = Celery("tasks", broker=BROKER_URL)
+app.conf.broker_connection_retry_on_startup = True
+
+if BROKER_URL.startswith("rediss://"):
+    app.conf.broker_use_ssl = {"ssl_cert_reqs": "none"}
+
+# Runs with the worker's embedded beat (-B); check_due keeps it to one run per interval
+app.conf.beat_schedule = {
+    "check-account-health": {"task": "celery_worker.check_account_health", "schedule": 60.0},
+}
+
+GRANT_TASK = "celery_worker.async_grant_access"
+FLUSH_TASK = "celery_worker.flush_grant_batch"
+EXPIRY_TASK = "celery_worker.update_expiration"
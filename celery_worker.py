@@ -1,23 +1,117 @@
 # celery_worker.py
-import os
+import time
 import asyncio
 from typing import Optional
-from celery import Celery
-from grant_access import grant_access
-
-BROKER_URL = (
-    os.getenv("CELERY_BROKER_URL")
-    or os.getenv("REDIS_URL")
-    or "redis://localhost:6379/0"
+from celery.signals import worker_process_init, worker_process_shutdown
+from browser_pool import BrowserPool
+from grant_access import (
+    grant_access, grant_access_many, update_expiration, close_backends, PLAYWRIGHT_HEADLESS, CHROMIUM_ARGS,
 )
+from celery_app import app
+from metrics import observe
+from grant_errors import classify, should_retry, backoff_delay
+from artifacts import current_task_id
+import grant_status
+
+# Per worker process: one event loop and one warm Chromium, reused across tasks.
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_pool: Optional[BrowserPool] = None
+
+
+@worker_process_init.connect
+def _start_browser_pool(**_):
+    global _loop, _pool
+    _loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(_loop)
+    _pool = BrowserPool(headless=PLAYWRIGHT_HEADLESS, args=CHROMIUM_ARGS)
+    try:
+        _loop.run_until_complete(_pool.start())
+    except Exception as e:
+        # Don't kill the worker; the pool relaunches lazily on first use
+        print(f"⚠️ Could not pre-launch Chromium: {e}")
+
+
+@worker_process_shutdown.connect
+def _stop_browser_pool(**_):
+    if _loop is not None and _pool is not None:
+        try:
+            _loop.run_until_complete(_pool.stop())
+            _loop.run_until_complete(close_backends())
+        except Exception:
+            pass
+        _loop.close()
+
+
+def run_async(coro):
+    """Run on the process-wide loop when the pool is up (prefork child), else a throwaway loop."""
+    if _loop is not None:
+        return _loop.run_until_complete(coro)
+    return asyncio.run(coro)
+
+
+def _observe_lag(enqueued_at: Optional[float]):
+    if enqueued_at:
+        observe("tvab_queue_lag_seconds", max(0.0, time.time() - enqueued_at), worker="celery")
+
+
+@app.task(bind=True, name="celery_worker.async_grant_access")
+def async_grant_access(
+    self,
+    username: str,
+    script_url: str,
+    trial_end_gmt: Optional[str] = None,
+    enqueued_at: Optional[float] = None,
+    account: Optional[str] = None,
+    grant_id: Optional[str] = None,
+) -> bool:
+    if not self.request.retries:
+        _observe_lag(enqueued_at)
+    current_task_id.set(self.request.id)
+    try:
+        # חשוב: להעביר את trial_end_gmt לפונקציה
+        return run_async(grant_access(
+            username, script_url, trial_end_gmt, pool=_pool, raise_on_error=True, account=account, grant_id=grant_id
+        ))
+    except Exception as e:
+        err = classify(e)
+        if should_retry(err, self.request.retries):
+            delay = backoff_delay(err.kind, self.request.retries)
+            print(f"🔁 {err.kind} at step {err.step} for {username}; retry #{self.request.retries + 1} in {delay:.0f}s")
+            grant_status.retrying(grant_id, delay, err.kind)
+            raise self.retry(countdown=delay, max_retries=None)
+        print(f"❌ Giving up on {username} ({err.kind} at step {err.step}): {err}")
+        if err.retryable:
+            # grant_access left the record open for a retry that won't come
+            grant_status.give_up(grant_id, str(err), err.kind)
+        return False
+
+
+@app.task(bind=True, name="celery_worker.flush_grant_batch")
+def flush_grant_batch(self, script_url: str, enqueued_at: Optional[float] = None) -> list:
+    """Run every grant coalesced for `script_url` in one Manage-access session."""
+    from dispatch import take_pending, retry_failed
+
+    _observe_lag(enqueued_at)
+    current_task_id.set(self.request.id)
+    grants = take_pending(script_url)
+    if not grants:
+        return []
+    results = run_async(grant_access_many(script_url, grants, pool=_pool))
+    retry_failed(script_url, grants, results)
+    return results
+
 
-app = Celery("tasks", broker=BROKER_URL)
-app.conf.broker_connection_retry_on_startup = True
+@app.task(bind=True, name="celery_worker.update_expiration")
+def update_expiration_task(self, username: str, script_url: str, trial_end_gmt: Optional[str] = None,
+                           enqueued_at: Optional[float] = None) -> bool:
+    """Change the expiry of a user who already has access (queued by reconcile.py)."""
+    _observe_lag(enqueued_at)
+    current_task_id.set(self.request.id)
+    return run_async(update_expiration(username, script_url, trial_end_gmt))
 
-if BROKER_URL.startswith("rediss://"):
-    app.conf.broker_use_ssl = {"ssl_cert_reqs": "none"}
 
-@app.task(name="celery_worker.async_grant_access")
-def async_grant_access(username: str, script_url: str, trial_end_gmt: Optional[str] = None) -> bool:
-    # חשוב: להעביר את trial_end_gmt לפונקציה
-    return asyncio.run(grant_access(username, script_url, trial_end_gmt))
+@app.task(name="celery_worker.check_account_health")
+def check_account_health():
+    """Take accounts whose TradingView session expired out of the pool."""
+    from account_pool import check_due
+    return check_due()
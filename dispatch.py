@@ -0,0 +1,158 @@
+# dispatch.py
+import os
+import json
+import time
+import uuid
+from typing import Optional
+from redis_client import get_redis
+from celery_app import app, GRANT_TASK, FLUSH_TASK, EXPIRY_TASK
+from grant_errors import backoff_delay
+import grant_status
+
+# Hold grants for the same script this long and send them as one batch (0 = off)
+GRANT_BATCH_WINDOW_SECONDS = float(os.getenv("GRANT_BATCH_WINDOW_SECONDS", "0"))
+
+# Park grants in rate-limited priority lanes released by scheduler.py
+GRANT_SCHEDULER = os.getenv("GRANT_SCHEDULER", "0") == "1"
+
+# "celery": prefork Celery worker. "asyncio": async_worker.py pulling from JOBS_KEY.
+GRANT_WORKER_MODE = os.getenv("GRANT_WORKER_MODE", "celery").lower()
+
+PENDING_KEY = "grant:pending:{script_url}"
+JOBS_KEY    = "grant:jobs"
+DELAYED_KEY = "grant:jobs:delayed"   # ZSET of jobs scored by the time they become due
+
+
+def push_job(job: dict, delay: float = 0):
+    """
+    Queue a job for the asyncio worker (FIFO: LPUSH here, right-pop there).
+    With `delay`, park it in DELAYED_KEY; the worker promotes it once due.
+    """
+    job.setdefault("id", uuid.uuid4().hex)
+    if delay > 0:
+        get_redis().zadd(DELAYED_KEY, {json.dumps(job): time.time() + delay})
+    else:
+        get_redis().lpush(JOBS_KEY, json.dumps(job))
+
+
+def submit_grant(username: str, script_url: str, trial_end_gmt: Optional[str] = None, account: Optional[str] = None,
+                 grant_id: Optional[str] = None):
+    """
+    Hand one grant straight to the configured worker; `account` is the one it should lease first.
+    `grant_id` (see grant_status) travels with the job in every mode.
+    """
+    if GRANT_WORKER_MODE == "asyncio":
+        push_job({
+            "type": "grant", "username": username, "script_url": script_url, "trial_end_gmt": trial_end_gmt,
+            "account": account, "grant_id": grant_id, "enqueued_at": time.time(),
+        })
+    else:
+        app.send_task(GRANT_TASK, args=[username, script_url, trial_end_gmt],
+                      kwargs={"enqueued_at": time.time(), "account": account, "grant_id": grant_id})
+
+
+def submit_expiry(username: str, script_url: str, trial_end_gmt: Optional[str] = None):
+    """Queue an expiry change for a user who already has access (reconcile.py's "expiry" rows)."""
+    if GRANT_WORKER_MODE == "asyncio":
+        push_job({
+            "type": "expiry", "username": username, "script_url": script_url, "trial_end_gmt": trial_end_gmt,
+            "enqueued_at": time.time(),
+        })
+    else:
+        app.send_task(EXPIRY_TASK, args=[username, script_url, trial_end_gmt], kwargs={"enqueued_at": time.time()})
+
+
+def _schedule_flush(script_url: str, delay: float):
+    if GRANT_WORKER_MODE == "asyncio":
+        push_job({"type": "flush", "script_url": script_url, "enqueued_at": time.time() + delay}, delay=delay)
+    else:
+        # lag is measured from the end of the batching window
+        app.send_task(FLUSH_TASK, args=[script_url], kwargs={"enqueued_at": time.time() + delay}, countdown=delay)
+
+
+def retry_grant(username: str, script_url: str, trial_end_gmt: Optional[str], kind: str, retries_done: int = 0,
+                grant_id: Optional[str] = None):
+    """Re-queue a failed grant after the backoff for its failure kind."""
+    delay = backoff_delay(kind, retries_done)
+    print(f"🔁 {kind} for {username}; retry #{retries_done + 1} in {delay:.0f}s")
+    grant_status.retrying(grant_id, delay, kind)
+    if GRANT_WORKER_MODE == "asyncio":
+        push_job({
+            "type": "grant", "username": username, "script_url": script_url, "trial_end_gmt": trial_end_gmt,
+            "grant_id": grant_id, "retries": retries_done + 1, "enqueued_at": time.time() + delay,
+        }, delay=delay)
+    else:
+        app.send_task(
+            GRANT_TASK, args=[username, script_url, trial_end_gmt],
+            kwargs={"enqueued_at": time.time() + delay, "grant_id": grant_id}, countdown=delay,
+        )
+
+
+def retry_failed(script_url: str, grants: list, results: list):
+    """Re-queue the retryable failures of a batch (take_pending triples) as individual grants."""
+    for (username, trial_end_gmt, grant_id), result in zip(grants, results):
+        if not result["ok"] and result.get("retryable"):
+            retry_grant(username, script_url, trial_end_gmt, result["error_kind"], grant_id=grant_id)
+
+
+def enqueue_grant(username: str, script_url: str, trial_end_gmt: Optional[str] = None, lane: str = "paid",
+                  grant_id: Optional[str] = None):
+    """Front door for new grants: through the scheduler's lanes if enabled, else straight on."""
+    if GRANT_SCHEDULER:
+        from scheduler import enqueue_scheduled
+        enqueue_scheduled(username, script_url, trial_end_gmt, lane, grant_id=grant_id)
+    else:
+        route_grant(username, script_url, trial_end_gmt, grant_id=grant_id)
+
+
+def route_grant(username: str, script_url: str, trial_end_gmt: Optional[str] = None, account: Optional[str] = None,
+                grant_id: Optional[str] = None):
+    """
+    Send one grant to the worker, coalescing with other grants for the same script when batching is on.
+    A batch leases whichever account is free, so `account` only applies to single grants.
+    """
+    if GRANT_BATCH_WINDOW_SECONDS <= 0:
+        submit_grant(username, script_url, trial_end_gmt, account, grant_id)
+        return
+
+    r = get_redis()
+    key = PENDING_KEY.format(script_url=script_url)
+    pipe = r.pipeline()
+    pipe.rpush(key, json.dumps([username, trial_end_gmt, grant_id]))
+    # Safety net in case the flush task is lost
+    pipe.expire(key, int(GRANT_BATCH_WINDOW_SECONDS) + 3600)
+    pending, _ = pipe.execute()
+
+    # First entry opens the window; later ones ride along with the scheduled flush
+    if pending == 1:
+        _schedule_flush(script_url, GRANT_BATCH_WINDOW_SECONDS)
+
+
+def submit_batch(script_url: str, grants: list):
+    """
+    Queue several (username, trial_end_gmt[, grant_id]) grants for one script
+    to run in one Manage-access session.
+    """
+    if not grants:
+        return
+    r = get_redis()
+    key = PENDING_KEY.format(script_url=script_url)
+    pipe = r.pipeline()
+    pipe.rpush(key, *[json.dumps(list(grant)) for grant in grants])
+    pipe.expire(key, int(GRANT_BATCH_WINDOW_SECONDS) + 3600)
+    pending, _ = pipe.execute()
+    # Otherwise a flush is already scheduled and takes these along
+    if pending == len(grants):
+        _schedule_flush(script_url, 0)
+
+
+def take_pending(script_url: str) -> list:
+    """Atomically drain the pending grants for a script: [(username, trial_end_gmt, grant_id), ...]."""
+    r = get_redis()
+    key = PENDING_KEY.format(script_url=script_url)
+    pipe = r.pipeline()  # MULTI/EXEC
+    pipe.lrange(key, 0, -1)
+    pipe.delete(key)
+    raw, _ = pipe.execute()
+    # submit_batch entries (and ones queued before grant ids) are pairs
+    return [(*entry, None)[:3] for entry in map(json.loads, raw)]
@@ -1,10 +1,24 @@
 # grant_access.py
 import os
+import re
+import random
 import asyncio
-from datetime import datetime, timedelta, timezone
+from contextlib import asynccontextmanager
 from typing import Optional
 from dotenv import load_dotenv
-from playwright.async_api import async_playwright, TimeoutError as PlaywrightTimeoutError
+from playwright.async_api import async_playwright, expect, TimeoutError as PlaywrightTimeoutError
+from selector_resolver import resolver
+from grant_ledger import already_granted, expiry_date, record_grant
+from metrics import inc, span
+from artifacts import capture_debug, capture_failure, finish_trace, start_trace
+from grant_errors import (
+    BackendValidationError, GrantError, SelectorDriftError, SessionExpiredError, TransientError, UserNotFoundError,
+    STEP_RETRIES, STEP_RETRY_BASE_SECONDS, classify,
+)
+from account_pool import accounts_for, cached_state, get_account, lease, mark_health, save_state
+from grant_backends import GrantBackend, HttpBackend
+from username_resolver import known_user, resolve_username
+import grant_status
 
 # Load .env if present (works both locally and on Heroku; on Heroku Config Vars override)
 load_dotenv()
@@ -26,39 +40,182 @@ if PLAYWRIGHT_NO_SANDBOX:
 DEFAULT_TIMEOUT = 10_000   # ms
 LONG_TIMEOUT    = 12_000   # ms
 
+# "event": wait on real page signals (XHRs, elements, dialog state).
+# "sleep": the old fixed pauses, kept as a fallback if TradingView changes its XHRs.
+GRANT_WAIT_MODE    = os.getenv("GRANT_WAIT_MODE", "event").lower()
+EVENT_WAIT_TIMEOUT = int(os.getenv("EVENT_WAIT_TIMEOUT_MS", "5000"))   # ms, per signal
+
+# XHRs the Manage-access dialog fires (overridable if TradingView renames them)
+USER_SEARCH_URL_RE = re.compile(os.getenv("TV_USER_SEARCH_URL_RE", r"/username_hint/"))
+GRANT_POST_URL_RE  = re.compile(os.getenv("TV_GRANT_POST_URL_RE", r"/pine_perm/(add|modify_user_expiration)/"))
+
+# "full": load the script page like a browser and wait for networkidle.
+# "lean": block images/media/fonts/trackers and only wait for the Manage access button.
+GRANT_PAGE_PROFILE = os.getenv("GRANT_PAGE_PROFILE", "full").lower()
+
+# Grant backends to try in order, e.g. "http,playwright"; the browser flow is always the last resort
+GRANT_BACKENDS = [b.strip() for b in os.getenv("GRANT_BACKENDS", "playwright").lower().split(",") if b.strip()]
+
+# Look the username up (cached) before any backend runs; unknown users fail fast
+USERNAME_PREVALIDATE = os.getenv("USERNAME_PREVALIDATE", "1") == "1"
+
+LEAN_BLOCKED_RESOURCE_TYPES = {"image", "media", "font"}
+LEAN_BLOCKED_HOSTS = (
+    "google-analytics.com",
+    "googletagmanager.com",
+    "doubleclick.net",
+    "googlesyndication.com",
+    "facebook.net",
+    "facebook.com/tr",
+    "snap.licdn.com",
+    "bat.bing.com",
+    "hotjar.com",
+    "amplitude.com",
+    "sentry.io",
+    "telemetry.tradingview.com",
+)
+
 
 # ---------- Utilities ----------
-async def first_visible(page, selectors, timeout=DEFAULT_TIMEOUT):
+async def first_visible(page, selectors, timeout=DEFAULT_TIMEOUT, step=None):
     """
-    Try selectors in order until one becomes visible; return its Locator.
+    Race all selectors under one shared deadline; return the Locator of the
+    highest-priority one that is visible. With `step`, the last winner for that
+    step is tried first (see selector_resolver).
     Raise PlaywrightTimeoutError if none match.
     """
-    last_error = None
-    for sel in selectors:
-        loc = page.locator(sel).first
-        try:
-            await loc.wait_for(state="visible", timeout=timeout)
-            # best-effort: also wait enabled briefly if possible
-            try:
-                await loc.wait_for(state="enabled", timeout=800)
-            except Exception:
-                pass
-            return loc
-        except PlaywrightTimeoutError as err:
-            last_error = err
-    raise PlaywrightTimeoutError(f"None of selectors {selectors} became visible") from last_error
+    return await resolver.resolve(page, selectors, timeout, step=step)
+
+
+async def wait_enabled(loc, timeout=3000) -> bool:
+    """Wait until `loc` is enabled; False on timeout."""
+    try:
+        await expect(loc).to_be_enabled(timeout=timeout)
+        return True
+    except AssertionError:
+        return False
+
+
+async def pause(page, sleep_ms, until=None):
+    """
+    Let the page settle after an action.
+    sleep mode: fixed `sleep_ms`. event mode: await `until()` (a coroutine factory
+    for the signal we actually need), or nothing if there is no such signal.
+    A missed signal is not an error; the next step has its own waits.
+    """
+    if GRANT_WAIT_MODE == "sleep":
+        await page.wait_for_timeout(sleep_ms)
+        return
+    if until is None:
+        return
+    try:
+        await until()
+    except (PlaywrightTimeoutError, AssertionError):
+        print(f"ℹ️ Settle signal not seen within its timeout (sleep equivalent {sleep_ms} ms)")
+
+
+async def act_and_wait(page, action, sleep_ms, url_re=None, method=None, until=None):
+    """
+    Run `action()` and wait for what it triggers: in event mode the first
+    response matching `url_re` (and `method`), then `until()`; in sleep mode
+    a fixed `sleep_ms` afterwards.
+    """
+    if GRANT_WAIT_MODE == "sleep" or url_re is None:
+        await action()
+        await pause(page, sleep_ms, until)
+        return
+
+    waiter = asyncio.ensure_future(page.wait_for_event(
+        "response",
+        predicate=lambda r: bool(url_re.search(r.url)) and (method is None or r.request.method == method),
+        timeout=EVENT_WAIT_TIMEOUT,
+    ))
+    try:
+        await action()
+    except BaseException:
+        waiter.cancel()
+        raise
+    try:
+        resp = await waiter
+        print(f"📡 {resp.request.method} {resp.url.split('?')[0]} -> {resp.status}")
+    except PlaywrightTimeoutError:
+        print(f"ℹ️ No response matching {url_re.pattern} within {EVENT_WAIT_TIMEOUT} ms")
+    await pause(page, sleep_ms, until)
+
+
+# ---------- Single-round-trip DOM scans ----------
+# Each scan is one page.evaluate that tags candidates with PICK_ATTR and returns
+# a snapshot; the chosen element is then clicked through `[PICK_ATTR='<index>']`.
+PICK_ATTR = "data-tvab-pick"
+
+_SCAN_BUTTONS_JS = """
+({selector, attr}) => {
+    document.querySelectorAll(`[${attr}]`).forEach(el => el.removeAttribute(attr));
+    return Array.from(document.querySelectorAll(selector)).map((el, index) => {
+        el.setAttribute(attr, String(index));
+        const style = window.getComputedStyle(el);
+        const visible = style.visibility !== "hidden" && style.display !== "none"
+            && el.getClientRects().length > 0;
+        const enabled = !el.disabled && el.getAttribute("aria-disabled") !== "true";
+        return {index, text: (el.textContent || "").trim(), visible, enabled};
+    });
+}
+"""
+
+_SCAN_USER_ROWS_JS = """
+({username, attr}) => {
+    document.querySelectorAll(`[${attr}]`).forEach(el => el.removeAttribute(attr));
+    const wanted = new Set([username.toLowerCase(), "@" + username.toLowerCase()]);
+    const isRow = el => el.tagName === "TR" || /row|user|item/.test(el.getAttribute("class") || "");
+    const isVisible = el => el.getClientRects().length > 0
+        && window.getComputedStyle(el).visibility !== "hidden";
+    const out = [];
+    const walker = document.createTreeWalker(document.body, NodeFilter.SHOW_ELEMENT);
+    for (let el = walker.nextNode(); el; el = walker.nextNode()) {
+        if (el.childElementCount !== 0 || !wanted.has((el.textContent || "").trim().toLowerCase())) continue;
+        let row = el;
+        while (row && !isRow(row)) row = row.parentElement;
+        const btn = row && Array.from(row.querySelectorAll("button")).find(
+            b => /Add access|Grant access/.test(b.textContent || ""));
+        const index = out.length;
+        if (btn) btn.setAttribute(attr, String(index));
+        out.push({
+            index,
+            text: el.textContent.trim(),
+            has_button: Boolean(btn),
+            visible: Boolean(btn) && isVisible(btn),
+            enabled: Boolean(btn) && !btn.disabled && btn.getAttribute("aria-disabled") !== "true",
+        });
+    }
+    return out;
+}
+"""
+
+
+async def scan_buttons(page, selector="button, [role='button']") -> list:
+    """Snapshot of matching buttons: [{index, text, visible, enabled}, ...]."""
+    return await page.evaluate(_SCAN_BUTTONS_JS, {"selector": selector, "attr": PICK_ATTR})
+
+
+def picked(page, index: int):
+    """Locator for an element tagged by the last scan."""
+    return page.locator(f"[{PICK_ATTR}='{index}']").first
 
 
 async def find_and_click_exact_user_button(page, username):
-    """Find an exact username result and click the Add/Grant access button in its row."""
-    print(f"🔄 Looking for exact username '{username}' ...")
-    await page.wait_for_timeout(3000)
+    """
+    Find the exact username among the results and click the Add/Grant access button in its row.
+    Never clicks a button that isn't in that user's row, so a look-alike can't get the grant.
+    """
+    name = username.lstrip("@")
+    print(f"🔄 Looking for exact username '{name}' ...")
+    # event mode: the exact-username wait below is the "result row appeared" signal
+    await pause(page, 3000)
 
     try:
-        exact = f"text=@{username}" if not username.startswith("@") else f"text={username}"
-        exact_el = page.locator(exact).first
+        exact_el = page.locator(f'text="@{name}"').first
         await exact_el.wait_for(state="visible", timeout=5000)
-        print(f"✅ Found exact username '{username}'")
+        print(f"✅ Found exact username '{name}'")
 
         # Button in same row/container
         user_row = exact_el.locator(
@@ -73,53 +230,37 @@ async def find_and_click_exact_user_button(page, username):
         if await add_btn.count() > 0:
             btn = add_btn.first
             await btn.wait_for(state="visible", timeout=3000)
-            await btn.wait_for(state="enabled", timeout=3000)
+            if not await wait_enabled(btn, 3000):
+                raise PlaywrightTimeoutError("'Add access' button not enabled")
             await btn.scroll_into_view_if_needed()
             await btn.click(force=True)
-            print(f"✅ Clicked 'Add access' for {username}")
+            print(f"✅ Clicked 'Add access' for {name}")
             return True
+    except Exception as e:
+        print(f"ℹ️ No exact '@{name}' row with a usable button yet ({e}) – scanning result rows")
 
-        # Fallback: first Add/Grant after the username element
-        add_btn = exact_el.locator(
-            "xpath=following::button[contains(., 'Add access') or contains(., 'Grant access')][1]"
-        )
-        if await add_btn.count() > 0:
-            btn = add_btn.first
-            await btn.wait_for(state="visible", timeout=3000)
-            await btn.wait_for(state="enabled", timeout=3000)
-            await btn.scroll_into_view_if_needed()
-            await btn.click(force=True)
-            print(f"✅ Clicked 'Add access' for {username} (fallback)")
-            return True
+    # Fallback: scan every username cell in one round trip (case-insensitive, still exact)
+    rows = await page.evaluate(_SCAN_USER_ROWS_JS, {"username": name, "attr": PICK_ATTR})
+    match = next((r for r in rows if r["visible"] and r["enabled"]), None)
+    if match:
+        btn = picked(page, match["index"])
+        await btn.scroll_into_view_if_needed()
+        await btn.click(force=True)
+        print(f"✅ Clicked 'Add access' for exact match {name} after scanning {len(rows)} rows")
+        return True
 
-        # Fallback: iterate visible usernames
-        all_usernames = page.locator("text=/^@?[a-zA-Z0-9_]+$/")
-        for i in range(await all_usernames.count()):
-            el = all_usernames.nth(i)
-            txt = (await el.text_content() or "").strip()
-            if txt == username or txt == f"@{username}":
-                user_row = el.locator(
-                    "xpath=ancestor-or-self::*[self::tr or "
-                    "self::*[contains(@class, 'row') or contains(@class, 'user') or contains(@class, 'item')]][1]"
-                )
-                add_btn = user_row.locator("button:has-text('Add access'), button:has-text('Grant access')")
-                if await add_btn.count() > 0:
-                    btn = add_btn.first
-                    await btn.wait_for(state="visible", timeout=3000)
-                    await btn.wait_for(state="enabled", timeout=3000)
-                    await btn.scroll_into_view_if_needed()
-                    await btn.click(force=True)
-                    print(f"✅ Clicked 'Add access' for exact match {username} after iterating")
-                    return True
-
-        print(f"⚠️ Could not find 'Add access' near {username}")
-        return False
-    except Exception as e:
-        print(f"⚠️ Could not find exact match for '{username}': {e}")
-        return False
+    print(f"⚠️ Could not find 'Add access' for {name}")
+    return False
 
 
 # ---------- Steps ----------
+async def signed_out(page) -> bool:
+    """No Manage access button + a Sign in button means the sessionid was logged out."""
+    return "/accounts/signin" in page.url or await page.locator(
+        "button:has-text('Sign in'), a[href*='/accounts/signin']"
+    ).first.is_visible()
+
+
 async def open_manage_access_dialog(page, username):
     try:
         print("🔍 Opening 'Manage access' dialog...")
@@ -128,7 +269,9 @@ async def open_manage_access_dialog(page, username):
         await manage_btn.first.scroll_into_view_if_needed()
         await manage_btn.first.click()
     except PlaywrightTimeoutError as e:
-        await page.screenshot(path=f"error_manage_btn_{username}.png")
+        await capture_failure(page, "manage_btn", username)
+        if await signed_out(page):
+            raise SessionExpiredError("TradingView session is logged out", "dialog") from e
         raise RuntimeError("Manage access button not found") from e
 
 
@@ -141,7 +284,7 @@ async def switch_to_add_new_users_tab(page, username):
         if (await add_tab.first.get_attribute("aria-selected")) != "true":
             await add_tab.first.click()
     except PlaywrightTimeoutError as e:
-        await page.screenshot(path=f"error_add_tab_{username}.png")
+        await capture_failure(page, "add_tab", username)
         raise RuntimeError("'Add new users' tab not found") from e
 
 
@@ -155,20 +298,26 @@ async def search_and_add_user(page, username):
                 "input[type='search']",
                 "input[type='text']",
                 "input[placeholder*='חפש משתמש']",
-            ]
+            ],
+            step="search_input",
         )
-        await search_input.fill(username)
-        await page.keyboard.press("Enter")
-        await page.wait_for_timeout(2000)
-
-        found = await find_and_click_exact_user_button(page, username)
-        if not found:
-            add_btn = await first_visible(page, ["text=Add access", "text=Grant access"])
-            await add_btn.scroll_into_view_if_needed()
-            await add_btn.click()
-            print("✅ Clicked first available 'Add access' button")
+        async def type_and_submit():
+            # the search XHR can fire while typing, so listen before fill()
+            await search_input.fill(username)
+            await page.keyboard.press("Enter")
+
+        await act_and_wait(page, type_and_submit, 2000, url_re=USER_SEARCH_URL_RE)
+
+        if not await find_and_click_exact_user_button(page, username):
+            # Never fall back to another row's button: that grants a look-alike user
+            await capture_failure(page, "user_not_found", username)
+            if known_user(username):
+                # The lookup saw this user, so the results were probably just slow: worth a retry
+                raise SelectorDriftError(f"'@{username.lstrip('@')}' exists but is not among the search results yet",
+                                         "search")
+            raise UserNotFoundError(f"'@{username.lstrip('@')}' is not among the search results", "search")
     except PlaywrightTimeoutError as e:
-        await page.screenshot(path=f"error_add_access_{username}.png")
+        await capture_failure(page, "add_access", username)
         raise RuntimeError("Failed to add user access") from e
 
 
@@ -179,7 +328,7 @@ async def set_expiration_date(page, username, expiry_iso: Optional[str] = None):
     """
     try:
         await page.mouse.wheel(0, 800)
-        await page.wait_for_timeout(300)
+        await pause(page, 300)
 
         labels = ["No expiration date", "ללא תאריך תפוגה", "Без даты окончания", "Sin fecha de vencimiento"]
         checkbox_label = page.locator(",".join(f"label:has-text('{t}')" for t in labels))
@@ -189,24 +338,16 @@ async def set_expiration_date(page, username, expiry_iso: Optional[str] = None):
             await checkbox_input.wait_for(state="attached", timeout=4000)
             if await checkbox_input.is_checked():
                 await checkbox_label.click()
-                await page.wait_for_timeout(300)
+                await pause(page, 300, until=lambda: expect(checkbox_input).not_to_be_checked(timeout=EVENT_WAIT_TIMEOUT))
         except PlaywrightTimeoutError:
             print("ℹ️ Checkbox not found – skipping toggle")
 
         # decide on expiry date string as YYYY-MM-DD
-        if expiry_iso:
-            try:
-                iso = expiry_iso.replace("Z", "+00:00")
-                dt = datetime.fromisoformat(iso)
-                expiry = dt.date().strftime("%Y-%m-%d")
-            except Exception:
-                expiry = (datetime.today() + timedelta(days=30)).strftime("%Y-%m-%d")
-        else:
-            expiry = (datetime.today() + timedelta(days=30)).strftime("%Y-%m-%d")
+        expiry = expiry_date(expiry_iso)
 
         date_input_selectors = ["input[placeholder='YYYY-MM-DD']", "input[placeholder='YYYY/MM/DD']", "input[type='date']"]
         try:
-            date_input = await first_visible(page, date_input_selectors, timeout=5000)
+            date_input = await first_visible(page, date_input_selectors, timeout=5000, step="date_input")
             await date_input.fill(expiry)
             await date_input.press("Enter")
         except PlaywrightTimeoutError:
@@ -222,7 +363,10 @@ async def set_expiration_date(page, username, expiry_iso: Optional[str] = None):
                 pass
         except Exception:
             pass
-        await page.wait_for_timeout(500)
+        await pause(
+            page, 500,
+            until=lambda: page.locator("[class*='popover'], [class*='calendar']").first.wait_for(state="hidden", timeout=1500),
+        )
 
         # Apply / Confirm
         print("🟢 Trying to click Apply/Confirm button...")
@@ -238,51 +382,37 @@ async def set_expiration_date(page, username, expiry_iso: Optional[str] = None):
             "button:has-text('OK')",
             "button[class*='primary'], button[class*='submit']",
         ]
-        apply_btn = None
-        for sel in selectors:
-            btn = page.locator(sel).first
-            try:
-                await btn.wait_for(state="visible", timeout=3000)
-                await btn.wait_for(state="enabled", timeout=3000)
-                apply_btn = btn
-                break
-            except Exception:
-                continue
+        try:
+            apply_btn = await first_visible(page, selectors, timeout=3000, step="apply")
+        except PlaywrightTimeoutError:
+            apply_btn = None
 
         if not apply_btn:
-            btns = page.locator("button, [role='button']")
-            for i in range(await btns.count()):
-                b = btns.nth(i)
-                try:
-                    txt = (await b.text_content() or "").lower()
-                    if any(w in txt for w in ["apply", "confirm", "save", "ok"]):
-                        await b.wait_for(state="visible", timeout=1200)
-                        await b.wait_for(state="enabled", timeout=1200)
-                        apply_btn = b
-                        break
-                except Exception:
-                    continue
+            for b in await scan_buttons(page):
+                if b["visible"] and b["enabled"] and any(w in b["text"].lower() for w in ["apply", "confirm", "save", "ok"]):
+                    apply_btn = picked(page, b["index"])
+                    break
 
         if apply_btn:
             print(f"🔍 Found Apply-like button: '{await apply_btn.text_content()}'")
             await apply_btn.scroll_into_view_if_needed()
             await apply_btn.click(force=True)
-            await page.wait_for_timeout(800)
+            await pause(page, 800, until=lambda: apply_btn.wait_for(state="hidden", timeout=EVENT_WAIT_TIMEOUT))
         else:
             print("⚠️ No Apply found; clicking outside modal as fallback")
             await page.mouse.click(50, 50)
-            await page.wait_for_timeout(500)
+            await pause(page, 500)
 
     except Exception as e:
         print(f"❌ Error in managing expiration: {e}")
-        await page.screenshot(path=f"error_date_{username}.png")
+        await capture_failure(page, "date", username)
         raise
 
 
 async def click_grant_access(page, username):
     try:
         print("🔍 Looking for Grant access button...")
-        await page.screenshot(path=f"debug_before_grant_{username}.png")
+        await capture_debug(page, "before_grant", username)
 
         grant_btn = await first_visible(
             page,
@@ -313,33 +443,29 @@ async def click_grant_access(page, username):
                 "button[class*='btn-confirm']",
             ],
             timeout=20_000,
+            step="grant_button",
         )
 
         print(f"🔍 Found button with text: '{await grant_btn.text_content()}'")
         await grant_btn.scroll_into_view_if_needed()
-        try:
-            await grant_btn.wait_for(state="enabled", timeout=8000)
-        except PlaywrightTimeoutError:
+        if not await wait_enabled(grant_btn, 8000):
             print("⚠️ Button not enabled; clicking anyway...")
-        await grant_btn.click(force=True)
-        await page.wait_for_timeout(2500)
-        await page.screenshot(path=f"debug_after_grant_{username}.png")
+        # event mode: grant POST completes, then the button leaves the dialog
+        await act_and_wait(
+            page, lambda: grant_btn.click(force=True), 2500,
+            url_re=GRANT_POST_URL_RE, method="POST",
+            until=lambda: grant_btn.wait_for(state="hidden", timeout=EVENT_WAIT_TIMEOUT),
+        )
+        await capture_debug(page, "after_grant", username)
     except PlaywrightTimeoutError as e:
         print(f"❌ Grant access button not found in time: {e}")
-        await page.screenshot(path=f"error_grant_access_btn_{username}.png")
+        await capture_failure(page, "grant_access_btn", username)
         # Debug: list buttons
         try:
-            all_buttons = page.locator("button")
-            print(f"🔍 Found {await all_buttons.count()} buttons on page")
-            for i in range(await all_buttons.count()):
-                b = all_buttons.nth(i)
-                try:
-                    t = await b.text_content()
-                    vis = await b.is_visible()
-                    en = await b.is_enabled()
-                    print(f"  Button {i}: text='{t}', visible={vis}, enabled={en}")
-                except Exception:
-                    pass
+            all_buttons = await scan_buttons(page, "button")
+            print(f"🔍 Found {len(all_buttons)} buttons on page")
+            for b in all_buttons:
+                print(f"  Button {b['index']}: text='{b['text']}', visible={b['visible']}, enabled={b['enabled']}")
         except Exception:
             pass
         # Try to close dialog
@@ -355,82 +481,455 @@ async def click_grant_access(page, username):
                     "button[class*='cancel']",
                 ],
                 timeout=6000,
+                step="close_dialog",
             )
             if close_btn:
                 await close_btn.click()
-                await page.wait_for_timeout(2000)
+                await pause(page, 2000, until=lambda: close_btn.wait_for(state="hidden", timeout=EVENT_WAIT_TIMEOUT))
                 print("✅ Closed dialog - maybe granted automatically")
         except Exception:
             pass
         raise
     except Exception as e:
         print(f"❌ General error clicking Grant access: {e}")
-        await page.screenshot(path=f"error_final_{username}.png")
+        await capture_failure(page, "final", username)
         raise
 
 
 # ---------- Public API ----------
-async def grant_access(username: str, script_url: str, trial_end_gmt: Optional[str] = None) -> bool:
-    """
-    Open the script page, add user, set expiration, and click Grant.
-    Returns True on success.
-    """
-    print(f"🔐 Granting access to {username} on {script_url}")
-    ok = True
+@asynccontextmanager
+async def _standalone_context(**context_kwargs):
+    """Launch a one-off browser for a single grant (used when no pool is given)."""
+    async with async_playwright() as p:
+        with span("launch"):
+            browser = await p.chromium.launch(headless=PLAYWRIGHT_HEADLESS, args=CHROMIUM_ARGS)
+        try:
+            with span("context"):
+                context = await browser.new_context(**context_kwargs)
+            try:
+                yield context
+            finally:
+                await context.close()
+        finally:
+            await browser.close()
+
 
+def _session_cookies(account: Optional[str] = None) -> list:
     # Read env at runtime (so Celery/Heroku imports don't fail)
-    session = os.getenv("TRADINGVIEW_SESSIONID")
-    ecuid   = os.getenv("TRADINGVIEW_ECUID")
-    if not session or not ecuid:
-        raise RuntimeError("Missing TRADINGVIEW_SESSIONID / TRADINGVIEW_ECUID")
+    return get_account(account).cookies()
 
-    async with async_playwright() as p:
-        browser = await p.chromium.launch(headless=PLAYWRIGHT_HEADLESS, args=CHROMIUM_ARGS)
-        context = await browser.new_context()
-        await context.add_cookies([
-            {
-                "name": "sessionid",
-                "value": session,
-                "domain": ".tradingview.com",
-                "path": "/",
-                "httpOnly": True,
-                "secure": True,
-                "sameSite": "Lax",
-            },
-            {
-                "name": "tv_ecuid",
-                "value": ecuid,
-                "domain": ".tradingview.com",
-                "path": "/",
-                "httpOnly": False,
-                "secure": True,
-                "sameSite": "Lax",
-            },
-        ])
-
-        page = await context.new_page()
-        # Global defaults for this page
-        page.set_default_timeout(15_000)
-        page.set_default_navigation_timeout(20_000)
-
-        await page.goto(script_url)
+
+@asynccontextmanager
+async def _account_context(script_url: str, pool=None, account: Optional[str] = None):
+    """
+    Lease an account that can manage `script_url` and yield (account, context)
+    logged in as it: from its cached storage_state when there is one, else its cookies.
+    """
+    async with lease(script_url, prefer=account) as acct:
+        state = cached_state(acct)
+        kwargs = {"storage_state": state} if state else {}
+        context_cm = pool.context(**kwargs) if pool is not None else _standalone_context(**kwargs)
+        async with context_cm as context:
+            if not state:
+                await context.add_cookies(acct.cookies())
+            yield acct, context
+
+
+async def _lean_route(route):
+    request = route.request
+    if request.resource_type in LEAN_BLOCKED_RESOURCE_TYPES or any(h in request.url for h in LEAN_BLOCKED_HOSTS):
+        await route.abort()
+    else:
+        await route.continue_()
+
+
+async def apply_page_profile(context, profile: Optional[str] = None):
+    """Install request blocking for the lean profile (no-op for full)."""
+    if (profile or GRANT_PAGE_PROFILE) == "lean":
+        await context.route("**/*", _lean_route)
+
+
+async def wait_page_ready(page, profile: Optional[str] = None):
+    """Raises SessionExpiredError on a logged-out page instead of timing out (retryably) on it."""
+    if "/accounts/signin" in page.url:
+        raise SessionExpiredError("TradingView session is logged out", "goto")
+    if (profile or GRANT_PAGE_PROFILE) == "lean":
+        # The page never really goes idle; the button is all we need
+        try:
+            await page.locator("button:has-text('Manage access')").first.wait_for(state="visible", timeout=20_000)
+        except PlaywrightTimeoutError as e:
+            if await signed_out(page):
+                raise SessionExpiredError("TradingView session is logged out", "goto") from e
+            raise
+    else:
         await page.wait_for_load_state("networkidle")
 
+
+async def _new_page(context):
+    await apply_page_profile(context)
+    page = await context.new_page()
+    # Global defaults for this page
+    page.set_default_timeout(15_000)
+    page.set_default_navigation_timeout(20_000)
+    return page
+
+
+async def _goto_script(page, script_url: str):
+    lean = GRANT_PAGE_PROFILE == "lean"
+    await page.goto(script_url, wait_until="domcontentloaded" if lean else "load")
+    await wait_page_ready(page)
+
+
+async def _open_script_page(context, script_url: str):
+    page = await _new_page(context)
+    with span("goto"):
+        await _goto_script(page, script_url)
+    return page
+
+
+async def _dialog_open(page) -> bool:
+    try:
+        return await page.locator("[role='dialog']").first.is_visible()
+    except Exception:
+        return False
+
+
+def _grant_steps(page, username: str, trial_end_gmt: Optional[str]) -> list:
+    """
+    The grant flow as (span name, step) pairs, run in order on an open script page.
+    Each step can be re-run on the same page, so a retry resumes where it failed
+    (or from "dialog" once the dialog is gone, see _run_steps).
+    """
+    async def dialog():
+        # Still open after a previous grant (batch) or a retried later step
+        if await page.locator("[role='tab']:has-text('Add new users')").first.is_visible():
+            return
+        await open_manage_access_dialog(page, username)
+
+    return [
+        ("dialog", dialog),
+        ("tab", lambda: switch_to_add_new_users_tab(page, username)),
+        ("search", lambda: search_and_add_user(page, username)),
+        ("expiry", lambda: set_expiration_date(page, username, expiry_iso=trial_end_gmt)),
+        ("grant", lambda: click_grant_access(page, username)),
+    ]
+
+
+async def _run_steps(steps: list, page=None):
+    """
+    Run steps in order. A retryable failure re-runs only the failed step on the
+    still-open page (up to STEP_RETRIES times, with jittered backoff) instead of
+    starting over from goto. Raises a classified GrantError when out of retries.
+    With `page`, a failed step after "dialog" whose dialog has closed (e.g. the
+    Grant button cleanup) starts over from "dialog": retrying it on the bare
+    script page could click some unrelated button.
+    """
+    names = [name for name, _ in steps]
+    rewind_to = names.index("dialog") if page is not None and "dialog" in names else None
+    attempts = {}
+    i = 0
+    while i < len(steps):
+        name, step = steps[i]
         try:
-            await open_manage_access_dialog(page, username)
-            await switch_to_add_new_users_tab(page, username)
-            await search_and_add_user(page, username)
-            await set_expiration_date(page, username, expiry_iso=trial_end_gmt)
-            await click_grant_access(page, username)
+            with span(name):
+                await step()
+            i += 1
         except Exception as e:
-            print(f"❌ Error during grant_access process: {e}")
-            ok = False
-        finally:
-            await context.close()
-            await browser.close()
+            err = classify(e, name)
+            attempt = attempts.get(name, 0)
+            if not err.retryable or attempt == STEP_RETRIES:
+                raise err
+            attempts[name] = attempt + 1
+            delay = STEP_RETRY_BASE_SECONDS * (2 ** attempt) * random.uniform(0.5, 1.5)
+            if rewind_to is not None and i > rewind_to and not await _dialog_open(page):
+                print(f"🔁 {err.kind} in step '{name}': {e} – dialog closed, reopening it in {delay:.1f}s")
+                i = rewind_to
+            else:
+                print(f"🔁 {err.kind} in step '{name}': {e} – retrying step in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+
+class PlaywrightBackend(GrantBackend):
+    """The full browser flow through the Manage access dialog. Always the last backend."""
+    name = "playwright"
+
+    def __init__(self, pool=None):
+        self.pool = pool
+
+    async def grant(self, username: str, script_url: str, trial_end_gmt: Optional[str] = None,
+                    account: Optional[str] = None):
+        async with _account_context(script_url, self.pool, account) as (acct, context):
+            await start_trace(context)
+            page = await _new_page(context)
+            error = None
+            try:
+                await _run_steps(
+                    [("goto", lambda: _goto_script(page, script_url))]
+                    + _grant_steps(page, username, trial_end_gmt),
+                    page,
+                )
+                await save_state(acct, context)
+            except Exception as e:
+                error = classify(e)
+                if isinstance(error, SessionExpiredError):
+                    error = _session_expired(acct, error, script_url)
+            await finish_trace(context, error is not None, error.step if error else "ok", username)
+        if error is not None:
+            raise error
+
+
+# Backends named in GRANT_BACKENDS, in order; Playwright is appended if missing
+BACKENDS = {"http": HttpBackend}
+_backends = {}
+
+
+def _backend(name: str) -> GrantBackend:
+    if name not in _backends:
+        _backends[name] = BACKENDS[name]()
+    return _backends[name]
+
+
+def grant_backends(pool=None) -> list:
+    chain = []
+    for name in GRANT_BACKENDS:
+        if name in BACKENDS:
+            chain.append(_backend(name))
+        elif name != "playwright":
+            print(f"⚠️ Unknown grant backend {name!r} ignored")
+    return chain + [PlaywrightBackend(pool)]
+
+
+async def _resolve(username: str, script_url: str, account: Optional[str] = None) -> str:
+    if not USERNAME_PREVALIDATE:
+        return username
+    return await resolve_username(username, script_url, _backend("http"), account)
+
+
+async def close_backends():
+    for backend in _backends.values():
+        await backend.aclose()
+    _backends.clear()
+
+
+async def grant_access(
+    username: str,
+    script_url: str,
+    trial_end_gmt: Optional[str] = None,
+    pool=None,
+    raise_on_error: bool = False,
+    account: Optional[str] = None,
+    grant_id: Optional[str] = None,
+) -> bool:
+    """
+    Grant `username` access to `script_url` until `trial_end_gmt` (default: 30 days).
+    The username is first normalized and checked against TradingView (cached, see
+    username_resolver); unknown users fail with UserNotFoundError right away.
+    Then tries each backend in GRANT_BACKENDS, falling back to the next one when a backend
+    can't validate its result, and finally to the Playwright flow: open the script
+    page, add user, set expiration, and click Grant. If `pool` (a BrowserPool) is
+    given, that runs in a fresh context on its warm browser; otherwise a browser is
+    launched just for this call.
+    Runs as an account leased from account_pool; `account` is tried first.
+    Returns True on success. On failure returns False, or raises the classified
+    GrantError if `raise_on_error` (so the caller can apply a retry policy).
+    With `grant_id`, its grant_status record follows along.
+    """
+    print(f"🔐 Granting access to {username} on {script_url}")
+    grant_status.start(grant_id)
+    if already_granted(username, script_url, trial_end_gmt):
+        print(f"⏭️ {username} already has access until {expiry_date(trial_end_gmt)} or later – skipping")
+        inc("tvab_grants_total", outcome="skipped")
+        grant_status.finish(grant_id, True, skipped=True)
+        return True
+
+    error = backend = None
+    status_token = grant_status.current_grant_id.set(grant_id)
+    try:
+        username = await _resolve(username, script_url, account)
+    except Exception as e:
+        error = classify(e, "resolve")
+        print(f"❌ {error}")
 
+    for backend in grant_backends(pool) if error is None else []:
+        try:
+            await backend.grant(username, script_url, trial_end_gmt, account)
+            error = None
+            break
+        except BackendValidationError as e:
+            error = e
+            print(f"↪️ {backend.name} backend could not grant {username} ({e.step}): {e} – falling back")
+            inc("tvab_backend_fallbacks_total", backend=backend.name, step=e.step)
+        except Exception as e:
+            error = classify(e)
+            print(f"❌ Error during grant_access process ({error.kind} at {error.step}): {e}")
+            break
+    grant_status.current_grant_id.reset(status_token)
+
+    ok = error is None
+    if ok:
+        record_grant(username, script_url, trial_end_gmt)
+        grant_status.finish(grant_id, True)
+    else:
+        grant_status.finish(grant_id, False, str(error), error.kind, error.retryable)
+    inc("tvab_grants_total", outcome="success" if ok else "failure",
+        kind=None if ok else error.kind, backend=backend.name if backend else None)
     print(f"✅ Done (success={ok})")
+    if error is not None and raise_on_error:
+        raise error
     return ok
 
 
-# Optional
+async def update_expiration(username: str, script_url: str, trial_end_gmt: Optional[str] = None,
+                            account: Optional[str] = None) -> bool:
+    """
+    Move the expiry of a user who already has access to `trial_end_gmt`
+    (reconcile.py's wrong-expiry rows). HTTP only: the Manage access dialog
+    adds users but can't edit them. Returns True on success; failures aren't
+    retried, the next reconcile run finds the row again.
+    """
+    print(f"📅 Updating expiry of {username} on {script_url} to {expiry_date(trial_end_gmt)}")
+    try:
+        await _backend("http").update_expiration(username, script_url, trial_end_gmt, account)
+        error = None
+    except Exception as e:
+        error = classify(e, "expiry")
+        print(f"❌ Could not update expiry of {username} ({error.kind} at {error.step}): {e}")
+    ok = error is None
+    if ok:
+        record_grant(username, script_url, trial_end_gmt)
+    inc("tvab_expiry_updates_total", outcome="success" if ok else "failure", kind=None if ok else error.kind)
+    return ok
+
+
+def _session_expired(acct, err: GrantError, script_url: str) -> GrantError:
+    """Take the account out of the pool; worth a retry if another account can take over."""
+    mark_health(acct.name, False, str(err))
+    if accounts_for(script_url):
+        return TransientError(f"Session of account {acct.name} expired: {err}", err.step)
+    return err
+
+
+def _fail_remaining(results: dict, todo: list, err: GrantError):
+    for i, username, _ in todo:
+        results.setdefault(i, {
+            "username": username, "ok": False, "error": str(err),
+            "error_kind": err.kind, "retryable": err.retryable,
+        })
+
+
+def _finish_batch(grants: list, results: dict) -> list:
+    """Results in input order; each grant_status record is closed (or left open for a retry)."""
+    ordered = [results[i] for i in range(len(grants))]
+    for (_, _, grant_id), r in zip(grants, ordered):
+        grant_status.finish(grant_id, r["ok"], r.get("error"), r.get("error_kind"),
+                            bool(r.get("retryable")), bool(r.get("skipped")))
+    return ordered
+
+
+async def grant_access_many(script_url: str, grants, pool=None) -> list:
+    """
+    Grant several users on the same script in one page/dialog session.
+    `grants` is an iterable of (username, trial_end_gmt) pairs, or
+    (username, trial_end_gmt, grant_id) triples to report to grant_status.
+    Returns one {"username", "ok", "error", "error_kind", "retryable"} dict per input, in order.
+    """
+    grants = [(*g, None)[:3] for g in grants]
+    print(f"🔐 Granting access to {len(grants)} users on {script_url}")
+    for _, _, grant_id in grants:
+        grant_status.start(grant_id)
+    results = {}
+    todo = []
+    for i, (username, trial_end_gmt, _) in enumerate(grants):
+        if already_granted(username, script_url, trial_end_gmt):
+            results[i] = {"username": username, "ok": True, "error": None, "skipped": True}
+            inc("tvab_grants_total", outcome="skipped")
+        else:
+            todo.append((i, username, trial_end_gmt))
+    if not todo:
+        print("⏭️ Everyone in the batch already has access – skipping")
+        return _finish_batch(grants, results)
+
+    resolved = []
+    for i, username, trial_end_gmt in todo:
+        try:
+            resolved.append((i, await _resolve(username, script_url), trial_end_gmt))
+        except Exception as e:
+            err = classify(e, "resolve")
+            print(f"❌ {err}")
+            _fail_remaining(results, [(i, username, trial_end_gmt)], err)
+            inc("tvab_grants_total", outcome="failure", kind=err.kind)
+    todo = resolved
+
+    # Browserless backends first; only what they can't validate goes through the dialog
+    for backend in grant_backends(pool)[:-1]:
+        remaining = []
+        for i, username, trial_end_gmt in todo:
+            grant_status.current_grant_id.set(grants[i][2])
+            try:
+                await backend.grant(username, script_url, trial_end_gmt)
+                record_grant(username, script_url, trial_end_gmt)
+                results[i] = {"username": username, "ok": True, "error": None}
+                inc("tvab_grants_total", outcome="success", backend=backend.name)
+            except BackendValidationError as e:
+                print(f"↪️ {backend.name} backend could not grant {username} ({e.step}): {e} – falling back")
+                inc("tvab_backend_fallbacks_total", backend=backend.name, step=e.step)
+                remaining.append((i, username, trial_end_gmt))
+            except Exception as e:
+                err = classify(e)
+                print(f"❌ Error granting {username} in batch ({err.kind} at {err.step}): {err}")
+                _fail_remaining(results, [(i, username, trial_end_gmt)], err)
+                inc("tvab_grants_total", outcome="failure", kind=err.kind, backend=backend.name)
+        todo = remaining
+    grant_status.current_grant_id.set(None)
+    if not todo:
+        return _finish_batch(grants, results)
+
+    try:
+        async with _account_context(script_url, pool) as (acct, context):
+            await start_trace(context)
+            try:
+                page = await _open_script_page(context, script_url)
+            except SessionExpiredError as err:
+                raise _session_expired(acct, err, script_url)
+
+            for i, username, trial_end_gmt in todo:
+                grant_status.current_grant_id.set(grants[i][2])
+                try:
+                    await _run_steps(_grant_steps(page, username, trial_end_gmt), page)
+                    record_grant(username, script_url, trial_end_gmt)
+                    results[i] = {"username": username, "ok": True, "error": None}
+                    inc("tvab_grants_total", outcome="success", backend="playwright")
+                except GrantError as err:
+                    print(f"❌ Error granting {username} in batch ({err.kind} at {err.step}): {err}")
+                    inc("tvab_grants_total", outcome="failure", kind=err.kind, backend="playwright")
+                    if isinstance(err, SessionExpiredError):
+                        # Every remaining user would fail the same way on this account
+                        _fail_remaining(results, todo, _session_expired(acct, err, script_url))
+                        break
+                    results[i] = {
+                        "username": username, "ok": False, "error": str(err),
+                        "error_kind": err.kind, "retryable": err.retryable,
+                    }
+                    # Unknown dialog state after a failure: start the next user from a clean page
+                    try:
+                        await page.reload(wait_until="domcontentloaded" if GRANT_PAGE_PROFILE == "lean" else "load")
+                        await wait_page_ready(page)
+                    except Exception as reload_err:
+                        print(f"⚠️ Reload after failure failed: {reload_err}")
+            grant_status.current_grant_id.set(None)
+
+            # Only this session's users: resolve/HTTP failures say nothing about the browser state
+            failed = [username for i, username, _ in todo if not results[i]["ok"]]
+            if len(failed) < len(todo):
+                await save_state(acct, context)
+            await finish_trace(context, bool(failed), "batch", ",".join(failed[:3]))
+    except Exception as e:
+        # No account, or the script page never opened: nobody left was granted
+        grant_status.current_grant_id.set(None)
+        err = classify(e, "goto")
+        print(f"❌ Batch on {script_url} aborted ({err.kind}): {e}")
+        _fail_remaining(results, todo, err)
+
+    results = _finish_batch(grants, results)
+    print(f"✅ Batch done ({sum(r['ok'] for r in results)}/{len(results)} succeeded)")
+    return results
@@ -0,0 +1,183 @@
+# grant_backends.py
+"""
+Pluggable ways of performing one grant.
+
+grant_access() tries the backends named in GRANT_BACKENDS in order. A backend
+either grants, raises BackendValidationError ("I can't vouch for this one, let
+the next backend do it"), or raises any other GrantError, which is final.
+The Playwright flow (grant_access.PlaywrightBackend) is always the last one.
+
+HttpBackend makes the same XHR calls the Manage access dialog makes, with the
+account's cookies and no browser:
+
+    GET  <script page>                  -> pine_id (cached)
+    GET  /username_hint/?s=<username>   -> the user exists
+    POST /pine_perm/add/                -> pine_id, username_recip, expiration
+    POST /pine_perm/modify_user_expiration/ -> same fields, for a user who already has access
+    POST /pine_perm/list_users/         -> current access list, newest first (reconcile.py)
+
+Endpoints are resolved against the script URL's origin, so the backend runs
+unchanged against mock_tradingview.py.
+"""
+import os
+import re
+import asyncio
+from typing import Optional
+from urllib.parse import urljoin
+import httpx
+from account_pool import lease
+from grant_ledger import expiry_date
+from grant_errors import BackendValidationError, UserNotFoundError
+from metrics import span
+from redis_client import get_redis
+
+HTTP_TIMEOUT_SECONDS = float(os.getenv("HTTP_TIMEOUT_SECONDS", "15"))
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "20"))
+HTTP_LIST_PAGE_SIZE = int(os.getenv("HTTP_LIST_PAGE_SIZE", "100"))
+PINE_ID_RE = re.compile(os.getenv("HTTP_PINE_ID_RE", r'"scriptIdPart"\s*:\s*"([^"]+)"'))
+
+PINE_IDS_KEY = "grant:pine_ids"   # hash script_url -> pine_id
+
+
+class GrantBackend:
+    """One way of granting `username` access to `script_url`."""
+    name = "base"
+
+    async def grant(self, username: str, script_url: str, trial_end_gmt: Optional[str] = None,
+                    account: Optional[str] = None):
+        raise NotImplementedError
+
+    async def aclose(self):
+        pass
+
+
+class HttpBackend(GrantBackend):
+    """Direct XHR calls over one pooled, keep-alive httpx client per event loop."""
+    name = "http"
+
+    def __init__(self):
+        self._client = None
+        self._loop = None
+        self._pine_ids = {}
+
+    def client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._loop is not loop:
+            self._client = httpx.AsyncClient(
+                timeout=HTTP_TIMEOUT_SECONDS,
+                follow_redirects=False,
+                limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS,
+                                    max_keepalive_connections=HTTP_MAX_CONNECTIONS),
+                headers={"User-Agent": "Mozilla/5.0", "X-Requested-With": "XMLHttpRequest"},
+            )
+            self._loop = loop
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _request(self, method: str, url: str, acct, step: str, **kwargs) -> httpx.Response:
+        headers = {
+            "Cookie": f"sessionid={acct.sessionid}; tv_ecuid={acct.ecuid}",
+            "Origin": urljoin(url, "/").rstrip("/"),
+            "Referer": kwargs.pop("referer", urljoin(url, "/")),
+        }
+        try:
+            resp = await self.client().request(method, url, headers=headers, **kwargs)
+        except httpx.HTTPError as e:
+            raise BackendValidationError(f"{method} {url} failed: {type(e).__name__}: {e}", step) from e
+        if resp.status_code != 200:
+            # 3xx to sign-in, 401/403, 5xx: let the browser flow sort it out
+            raise BackendValidationError(f"{method} {url} returned {resp.status_code}", step)
+        return resp
+
+    async def pine_id(self, script_url: str, acct) -> str:
+        if script_url in self._pine_ids:
+            return self._pine_ids[script_url]
+        try:
+            cached = get_redis().hget(PINE_IDS_KEY, script_url)
+        except Exception:
+            cached = None
+        if not cached:
+            resp = await self._request("GET", script_url, acct, "pine_id")
+            match = PINE_ID_RE.search(resp.text)
+            if not match or not match.group(1).startswith("PUB;"):
+                raise BackendValidationError("No pine_id on the script page", "pine_id")
+            cached = match.group(1)
+            try:
+                get_redis().hset(PINE_IDS_KEY, script_url, cached)
+            except Exception:
+                pass
+        self._pine_ids[script_url] = cached
+        return cached
+
+    async def lookup_user(self, username: str, script_url: str, acct) -> Optional[str]:
+        """The username as TradingView spells it, or None if user search has no exact (case-insensitive) match."""
+        url = urljoin(script_url, "/username_hint/")
+        resp = await self._request("GET", url, acct, "search", params={"s": username}, referer=script_url)
+        try:
+            names = {u["username"].lower(): u["username"] for u in resp.json()}
+        except (ValueError, TypeError, KeyError, AttributeError) as e:
+            raise BackendValidationError(f"Unexpected username_hint response: {e}", "search") from e
+        return names.get(username.lower())
+
+    async def check_user(self, username: str, script_url: str, acct):
+        if await self.lookup_user(username, script_url, acct) is None:
+            raise UserNotFoundError(f"No exact match for @{username} in user search", "search")
+
+    async def list_users_page(self, script_url: str, acct, next_url: Optional[str] = None) -> tuple:
+        """One page of the access list: (users, next page URL or None, total count or None)."""
+        pine_id = await self.pine_id(script_url, acct)
+        url = urljoin(script_url, next_url) if next_url else urljoin(
+            script_url, f"/pine_perm/list_users/?limit={HTTP_LIST_PAGE_SIZE}&order_by=-created")
+        resp = await self._request("POST", url, acct, "list_users", referer=script_url, data={"pine_id": pine_id})
+        try:
+            data = resp.json()
+            users = [{"username": u["username"], "expiration": u.get("expiration")} for u in data["results"]]
+        except (ValueError, TypeError, KeyError) as e:
+            raise BackendValidationError(f"Unexpected list_users response: {e}", "list_users") from e
+        return users, data.get("next"), data.get("count")
+
+    async def _perm_post(self, path: str, pine_id: str, username: str, script_url: str,
+                         trial_end_gmt: Optional[str], acct, step: str):
+        """POST a pine_perm change for one user; anything but {"status": "ok"} is a BackendValidationError."""
+        resp = await self._request(
+            "POST", urljoin(script_url, path), acct, step, referer=script_url,
+            data={
+                "pine_id": pine_id,
+                "username_recip": username,
+                "expiration": f"{expiry_date(trial_end_gmt)}T23:59:59.999Z",
+            },
+        )
+        try:
+            ok = resp.json().get("status") == "ok"
+        except (ValueError, AttributeError):
+            ok = False
+        if not ok:
+            raise BackendValidationError(f"{path.strip('/')} answered {resp.text[:200]!r}", step)
+
+    async def grant(self, username: str, script_url: str, trial_end_gmt: Optional[str] = None,
+                    account: Optional[str] = None):
+        username = username.lstrip("@")
+        async with lease(script_url, prefer=account) as acct:
+            with span("pine_id", backend=self.name):
+                pine_id = await self.pine_id(script_url, acct)
+            with span("search", backend=self.name):
+                await self.check_user(username, script_url, acct)
+            with span("grant", backend=self.name):
+                await self._perm_post("/pine_perm/add/", pine_id, username, script_url, trial_end_gmt, acct, "grant")
+        print(f"✅ Granted {username} over HTTP as account {acct.name}")
+
+    async def update_expiration(self, username: str, script_url: str, trial_end_gmt: Optional[str] = None,
+                                account: Optional[str] = None):
+        """Move the expiry of a user who already has access (reconcile's wrong-expiry rows)."""
+        username = username.lstrip("@")
+        async with lease(script_url, prefer=account) as acct:
+            with span("pine_id", backend=self.name):
+                pine_id = await self.pine_id(script_url, acct)
+            with span("expiry", backend=self.name):
+                await self._perm_post("/pine_perm/modify_user_expiration/", pine_id, username, script_url,
+                                      trial_end_gmt, acct, "expiry")
+        print(f"📅 Expiry of {username} set to {expiry_date(trial_end_gmt)} over HTTP as account {acct.name}")
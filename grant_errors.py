@@ -0,0 +1,92 @@
+# grant_errors.py
+import os
+import random
+from typing import Optional
+
+
+class GrantError(RuntimeError):
+    """A classified grant failure. `kind` keys the retry policy; `step` is where it happened."""
+    kind = "error"
+    retryable = False
+
+    def __init__(self, message: str, step: Optional[str] = None):
+        super().__init__(message)
+        self.step = step
+
+
+class SessionExpiredError(GrantError):
+    """The TradingView sessionid is no longer logged in. Retrying won't help."""
+    kind = "session_expired"
+
+
+class UserNotFoundError(GrantError):
+    """The TradingView username does not exist (no search results)."""
+    kind = "user_not_found"
+
+
+class SelectorDriftError(GrantError):
+    """An expected element never showed up: UI still loading, or TradingView changed its markup."""
+    kind = "selector_drift"
+    retryable = True
+
+
+class NavigationTimeoutError(GrantError):
+    """The script page did not load in time."""
+    kind = "navigation_timeout"
+    retryable = True
+
+
+class TransientError(GrantError):
+    """Anything else (browser crash, network error); worth another try."""
+    kind = "transient"
+    retryable = True
+
+
+class BackendValidationError(GrantError):
+    """A grant backend got an answer it can't vouch for; the next backend should take over."""
+    kind = "backend_validation"
+    retryable = True
+
+
+# kind -> (attempts across task retries, base delay s, max delay s)
+RETRY_POLICY = {
+    "selector_drift":     (int(os.getenv("GRANT_RETRIES_SELECTOR_DRIFT", "3")), 30, 600),
+    "navigation_timeout": (int(os.getenv("GRANT_RETRIES_NAVIGATION", "4")), 15, 300),
+    "transient":          (int(os.getenv("GRANT_RETRIES_TRANSIENT", "4")), 10, 300),
+}
+
+# Retries of the failed step on the still-open page, before giving up the attempt
+STEP_RETRIES = int(os.getenv("GRANT_STEP_RETRIES", "2"))
+STEP_RETRY_BASE_SECONDS = float(os.getenv("GRANT_STEP_RETRY_BASE_SECONDS", "1"))
+
+
+def classify(exc: BaseException, step: Optional[str] = None) -> GrantError:
+    """Map any exception from the flow to a GrantError subclass."""
+    if isinstance(exc, GrantError):
+        if exc.step is None:
+            exc.step = step
+        return exc
+    # Imported here so the web tier (which only needs the error types) never loads Playwright
+    from playwright.async_api import TimeoutError as PlaywrightTimeoutError
+    timed_out = isinstance(exc, PlaywrightTimeoutError) or isinstance(exc.__cause__, PlaywrightTimeoutError)
+    if timed_out and step == "goto":
+        err = NavigationTimeoutError(str(exc), step)
+    elif timed_out:
+        err = SelectorDriftError(str(exc), step)
+    else:
+        err = TransientError(f"{type(exc).__name__}: {exc}", step)
+    err.__cause__ = exc
+    return err
+
+
+def should_retry(err: GrantError, retries_done: int) -> bool:
+    if not err.retryable:
+        return False
+    attempts, _, _ = RETRY_POLICY.get(err.kind, (0, 0, 0))
+    return retries_done < attempts
+
+
+def backoff_delay(kind: str, retries_done: int) -> float:
+    """Exponential backoff with full jitter for the given failure kind."""
+    _, base, cap = RETRY_POLICY.get(kind, (0, 10, 300))
+    return random.uniform(0, min(cap, base * (2 ** retries_done)))
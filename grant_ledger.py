@@ -0,0 +1,92 @@
+# grant_ledger.py
+import os
+import hashlib
+from datetime import datetime, timedelta
+from typing import Optional
+from redis_client import get_redis
+
+# Webhook duplicates (WooCommerce retries, several subscription events per order)
+DEDUP_TTL_SECONDS = int(os.getenv("GRANT_DEDUP_TTL_SECONDS", "900"))
+DEDUP_KEY  = "grant:dedup:{digest}"
+LEDGER_KEY = "grant:ledger"   # hash: "<script_url>|<username>" -> granted expiry (YYYY-MM-DD)
+
+
+def expiry_date(trial_end_gmt: Optional[str]) -> str:
+    """Expiry as YYYY-MM-DD: the trial end if parseable, otherwise today + 30 days."""
+    if trial_end_gmt:
+        try:
+            iso = trial_end_gmt.replace("Z", "+00:00")
+            return datetime.fromisoformat(iso).date().strftime("%Y-%m-%d")
+        except Exception:
+            pass
+    return (datetime.today() + timedelta(days=30)).strftime("%Y-%m-%d")
+
+
+def normalize_username(username: str) -> str:
+    return username.strip().lstrip("@").lower()
+
+
+def _ledger_field(username: str, script_url: str) -> str:
+    return f"{script_url}|{normalize_username(username)}"
+
+
+def _dedup_key(username: str, script_url: str, trial_end_gmt: Optional[str]) -> str:
+    raw = f"{_ledger_field(username, script_url)}|{trial_end_gmt or ''}"
+    return DEDUP_KEY.format(digest=hashlib.sha1(raw.encode()).hexdigest())
+
+
+def claim_webhook(username: str, script_url: str, trial_end_gmt: Optional[str], grant_id: Optional[str] = None) -> bool:
+    """
+    True if this (username, script_url, trial_end) was not seen within the TTL.
+    The claim remembers `grant_id`, for duplicates to point at (claimed_by).
+    Fails open: if Redis is unreachable, every webhook is treated as new.
+    """
+    key = _dedup_key(username, script_url, trial_end_gmt)
+    try:
+        return bool(get_redis().set(key, grant_id or 1, nx=True, ex=DEDUP_TTL_SECONDS))
+    except Exception as e:
+        print(f"⚠️ Dedup check failed, enqueueing anyway: {e}")
+        return True
+
+
+def claimed_by(username: str, script_url: str, trial_end_gmt: Optional[str]) -> Optional[str]:
+    """The grant_id of the webhook that claimed this grant, if it had one."""
+    try:
+        owner = get_redis().get(_dedup_key(username, script_url, trial_end_gmt))
+    except Exception:
+        return None
+    return owner if owner and owner != "1" else None
+
+
+def release_webhook(username: str, script_url: str, trial_end_gmt: Optional[str]):
+    """Undo claim_webhook when the grant could not be enqueued, so the sender's retry gets through."""
+    try:
+        get_redis().delete(_dedup_key(username, script_url, trial_end_gmt))
+    except Exception as e:
+        print(f"⚠️ Could not release dedup key: {e}")
+
+
+def already_granted(username: str, script_url: str, trial_end_gmt: Optional[str]) -> bool:
+    """True if the ledger shows access with the same or a later expiry."""
+    try:
+        granted = get_redis().hget(LEDGER_KEY, _ledger_field(username, script_url))
+    except Exception as e:
+        print(f"⚠️ Ledger lookup failed: {e}")
+        return False
+    # ISO dates compare correctly as strings
+    return bool(granted) and granted >= expiry_date(trial_end_gmt)
+
+
+def record_grant(username: str, script_url: str, trial_end_gmt: Optional[str]):
+    try:
+        get_redis().hset(LEDGER_KEY, _ledger_field(username, script_url), expiry_date(trial_end_gmt))
+    except Exception as e:
+        print(f"⚠️ Could not record grant in ledger: {e}")
+
+
+def forget_grant(username: str, script_url: str):
+    """Drop the ledger entry so the next grant really runs (e.g. access was removed on TradingView)."""
+    try:
+        get_redis().hdel(LEDGER_KEY, _ledger_field(username, script_url))
+    except Exception as e:
+        print(f"⚠️ Could not clear ledger entry: {e}")
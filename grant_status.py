@@ -0,0 +1,185 @@
+# grant_status.py
+"""
+Per-grant status records for clients of /webhook.
+
+/webhook answers with a grant_id; GET /grants/<grant_id> returns the record
+below, and with ?wait=<s> holds the request until the grant is final.
+
+    grant:status:<id>  hash
+        id, username, script_url, trial_end_gmt
+        state        received | queued | running | retrying | succeeded | failed | duplicate
+        final        "1" once the state won't change again
+        step         current grant step (from metrics.span)
+        attempts, queued_at, started_at, finished_at, updated_at
+        error, error_kind, retry_at, skipped, task_id (artifacts index)
+        duplicate_of the grant a duplicate webhook was folded into
+
+The grant_id travels with the job (scheduler lane, batch entry, Celery
+kwargs, asyncio job), so each record follows exactly its own grant. Grants
+started without one (bulk imports, reconcile) have no record. Every update
+is published on grant:status:<id> so long-polls wake up at once.
+"""
+import os
+import json
+import time
+from contextvars import ContextVar
+from typing import Optional
+from redis_client import get_redis
+from grant_ledger import normalize_username
+from artifacts import current_task_id, list_artifacts
+import metrics
+
+GRANT_STATUS_TTL_SECONDS = int(os.getenv("GRANT_STATUS_TTL_SECONDS", str(7 * 24 * 3600)))
+GRANT_STATUS_MAX_WAIT_SECONDS = float(os.getenv("GRANT_STATUS_MAX_WAIT_SECONDS", "25"))
+
+STATUS_KEY = "grant:status:{id}"
+
+# Grant the current task is working on (read by the step hook)
+current_grant_id: ContextVar[Optional[str]] = ContextVar("current_grant_id", default=None)
+
+
+def _write(grant_id: Optional[str], fields: dict, pipe=None):
+    """HSET `fields` on the record and notify long-polls. Best-effort, like metrics."""
+    if not grant_id:
+        return
+    fields = {k: "" if v is None else v for k, v in {**fields, "updated_at": time.time()}.items()}
+    try:
+        p = pipe if pipe is not None else get_redis().pipeline(transaction=False)
+        key = STATUS_KEY.format(id=grant_id)
+        p.hset(key, mapping=fields)
+        p.expire(key, GRANT_STATUS_TTL_SECONDS)
+        p.publish(key, fields.get("state", "update"))
+        if pipe is None:
+            p.execute()
+    except Exception as e:
+        print(f"⚠️ Could not update grant status: {e}")
+
+
+def receive(grant_id: str, pipe=None):
+    """Async ingest: the body is accepted but not parsed yet."""
+    _write(grant_id, {"id": grant_id, "state": "received", "queued_at": time.time()}, pipe)
+
+
+def reject(grant_id: Optional[str], error: Optional[str], state: str = "failed", **fields):
+    """Final without ever running: invalid body, duplicate, enqueue failure."""
+    _write(grant_id, {
+        "id": grant_id, "state": state, "final": 1, "finished_at": time.time(),
+        "error": error, "error_kind": "invalid" if state == "failed" else None, **fields,
+    })
+
+
+def create(grant_id: str, username: str, script_url: str, trial_end_gmt: Optional[str]):
+    """A fresh record; an earlier run under the same id (bulk_import row keys) is wiped, not merged."""
+    try:
+        pipe = get_redis().pipeline(transaction=True)
+        pipe.delete(STATUS_KEY.format(id=grant_id))
+        _write(grant_id, {
+            "id": grant_id, "username": username, "script_url": script_url, "trial_end_gmt": trial_end_gmt,
+            "state": "queued", "attempts": 0, "queued_at": time.time(),
+        }, pipe)
+        pipe.execute()
+    except Exception as e:
+        print(f"⚠️ Could not create grant status: {e}")
+
+
+def start(grant_id: Optional[str]):
+    if not grant_id:
+        return
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        pipe.hincrby(STATUS_KEY.format(id=grant_id), "attempts", 1)
+        _write(grant_id, {"state": "running", "started_at": time.time(), "task_id": current_task_id.get(),
+                          "error": None, "error_kind": None, "retry_at": None}, pipe)
+        pipe.execute()
+    except Exception as e:
+        print(f"⚠️ Could not update grant status: {e}")
+
+
+def finish(grant_id: Optional[str], ok: bool, error: Optional[str] = None, error_kind: Optional[str] = None,
+           retryable: bool = False, skipped: bool = False):
+    """Succeeded, or failed. A retryable failure stays open until retrying() or give_up()."""
+    _write(grant_id, {
+        "state": "succeeded" if ok else "failed", "final": 1 if ok or not retryable else 0, "step": None,
+        "finished_at": time.time(), "error": error, "error_kind": error_kind, "skipped": 1 if skipped else None,
+    })
+
+
+def retrying(grant_id: Optional[str], delay: float, kind: str):
+    _write(grant_id, {"state": "retrying", "retry_at": time.time() + delay, "error_kind": kind})
+
+
+def give_up(grant_id: Optional[str], error: str, kind: str):
+    _write(grant_id, {
+        "state": "failed", "final": 1, "step": None, "finished_at": time.time(), "error": error, "error_kind": kind,
+    })
+
+
+def _on_step(step: str):
+    _write(current_grant_id.get(), {"step": step})
+
+
+metrics.STEP_HOOKS.append(_on_step)
+
+
+# ---------- Reading (web side) ----------
+def _parse(record: dict) -> Optional[dict]:
+    if not record:
+        return None
+    out = {}
+    for k, v in record.items():
+        if v == "":
+            continue
+        if k in ("attempts", "final", "skipped"):
+            out[k] = int(v)
+        elif k.endswith("_at"):
+            out[k] = float(v)
+        else:
+            out[k] = v
+    out["final"] = bool(out.get("final"))
+    return out
+
+
+def get_many(grant_ids: list) -> list:
+    """Records (None where missing) for many ids in one round trip, without artifacts."""
+    pipe = get_redis().pipeline(transaction=False)
+    for grant_id in grant_ids:
+        pipe.hgetall(STATUS_KEY.format(id=grant_id))
+    return [_parse(record) for record in pipe.execute()]
+
+
+def get(grant_id: str) -> Optional[dict]:
+    out = _parse(get_redis().hgetall(STATUS_KEY.format(id=grant_id)))
+    if out is None:
+        return None
+    if out.get("state") == "failed" and out.get("task_id"):
+        user = normalize_username(out.get("username", ""))
+        # Batch traces are labelled with several comma-separated usernames
+        out["artifacts"] = [a for a in list_artifacts(out["task_id"])
+                            if user in (normalize_username(u) for u in a["username"].split(","))]
+    return out
+
+
+def wait_for_final(grant_id: str, timeout: float) -> Optional[dict]:
+    """The record once it is final, or as it stands after `timeout` seconds."""
+    timeout = max(0.0, min(timeout, GRANT_STATUS_MAX_WAIT_SECONDS))
+    record = get(grant_id)
+    if record is None or record["final"] or timeout == 0:
+        return record
+    pubsub = get_redis().pubsub(ignore_subscribe_messages=True)
+    try:
+        # Subscribe, then re-read: an update between the two is not lost
+        pubsub.subscribe(STATUS_KEY.format(id=grant_id))
+        deadline = time.monotonic() + timeout
+        while True:
+            record = get(grant_id)
+            remaining = deadline - time.monotonic()
+            if record is None or record["final"] or remaining <= 0:
+                return record
+            pubsub.get_message(timeout=remaining)
+    finally:
+        pubsub.close()
+
+
+if __name__ == "__main__":
+    import sys
+    print(json.dumps(get(sys.argv[1]), indent=2))
@@ -0,0 +1,179 @@
+# ingest.py
+"""
+Webhook body -> queued grant, without Flask or Playwright.
+
+Fields are pulled from the payload by a small path schema instead of walking
+the whole WooCommerce order. Each field lists candidate paths, tried in order:
+
+    "tradingview_username"                           top-level key
+    "meta_data.@tradingview_username"                value of the {"key", "value"} entry with that key
+    "line_items.*.meta_data.@tradingview_script_url" first list item that has it
+
+WEBHOOK_FIELD_PATHS (JSON, same shape as FIELD_PATHS) overrides the schema.
+Bodies are parsed with orjson when it is installed.
+
+With WEBHOOK_INGEST_MODE=async the web handler only LPUSHes the raw body to
+INGEST_KEY and answers 202; `python ingest.py` drains that list.
+
+Either way the response carries a grant_id to poll (see grant_status). In
+async mode it is minted up front and travels as "<grant_id>\n<body>".
+"""
+import os
+import json
+import signal
+import socket
+import uuid
+from typing import Optional
+from grant_ledger import claim_webhook, claimed_by, release_webhook
+from dispatch import enqueue_grant
+from scheduler import lane_for
+from redis_client import get_redis
+import grant_status
+
+try:
+    import orjson
+    loads = orjson.loads
+except ImportError:
+    loads = json.loads
+
+# "sync": parse and enqueue in the request. "async": push the raw body, a drainer does the rest.
+WEBHOOK_INGEST_MODE = os.getenv("WEBHOOK_INGEST_MODE", "sync").lower()
+WEBHOOK_MAX_BYTES = int(os.getenv("WEBHOOK_MAX_BYTES", str(256 * 1024)))
+
+INGEST_KEY = "webhook:ingest"
+INGEST_PROCESSING_KEY = f"{INGEST_KEY}:processing:{os.getenv('DYNO') or socket.gethostname()}"
+
+FIELD_PATHS = {
+    "username": ["tradingview_username", "meta_data.@tradingview_username"],
+    "script_url": ["tradingview_script_url", "line_items.*.meta_data.@tradingview_script_url"],
+    "trial_end": ["trial_end_date_gmt", "trial_end_gmt"],
+}
+if os.getenv("WEBHOOK_FIELD_PATHS"):
+    FIELD_PATHS = {**FIELD_PATHS, **json.loads(os.getenv("WEBHOOK_FIELD_PATHS"))}
+
+_compiled = {field: [path.split(".") for path in paths] for field, paths in FIELD_PATHS.items()}
+
+
+def _walk(node, steps: list):
+    if not steps:
+        return node
+    step, rest = steps[0], steps[1:]
+    if step == "*":
+        for item in node if isinstance(node, list) else ():
+            found = _walk(item, rest)
+            if found:
+                return found
+        return None
+    if step.startswith("@"):
+        key = step[1:]
+        for item in node if isinstance(node, list) else ():
+            if isinstance(item, dict) and item.get("key") == key:
+                return _walk(item.get("value"), rest)
+        return None
+    return _walk(node.get(step), rest) if isinstance(node, dict) else None
+
+
+def extract_field(payload: dict, field: str):
+    for steps in _compiled[field]:
+        found = _walk(payload, steps)
+        if found:
+            return found
+    return None
+
+
+def extract_fields(payload: dict):
+    """(username, script_url, trial_end) from a simple or a WooCommerce Subscriptions payload."""
+    return (
+        extract_field(payload, "username"),
+        extract_field(payload, "script_url"),
+        extract_field(payload, "trial_end"),
+    )
+
+
+def _invalid(error: str, grant_id: Optional[str]) -> tuple:
+    grant_status.reject(grant_id, error)
+    return 400, {"error": error}
+
+
+def process_body(raw, grant_id: Optional[str] = None) -> tuple:
+    """
+    Parse, dedup and enqueue one webhook body. Returns (HTTP status, response dict).
+    `grant_id` is the id already handed out for this body (async mode).
+    """
+    try:
+        data = loads(raw)
+    except Exception:
+        return _invalid("invalid json", grant_id)
+    if not isinstance(data, dict):
+        return _invalid("invalid json", grant_id)
+
+    username, script_url, trial_end = extract_fields(data)
+    if not username or not script_url:
+        return _invalid("missing username or script_url", grant_id)
+
+    handed_out = grant_id
+    grant_id = grant_id or uuid.uuid4().hex
+    if not claim_webhook(username, script_url, trial_end, grant_id):
+        print(f"⚠️ duplicate webhook ignored: user={username}, url={script_url}, trial_end_gmt={trial_end}")
+        # Point the client at the grant that claimed it; an id already handed out (async mode) is closed
+        original = claimed_by(username, script_url, trial_end)
+        grant_status.reject(handed_out, None, state="duplicate", duplicate_of=original)
+        return 200, {"status": "duplicate", "grant_id": original}
+
+    print(f"📥 enqueue grant: user={username}, url={script_url}, trial_end_gmt={trial_end}")
+    grant_status.create(grant_id, username, script_url, trial_end)
+    try:
+        enqueue_grant(username, script_url, trial_end, lane=lane_for(data, trial_end), grant_id=grant_id)
+    except Exception as e:
+        release_webhook(username, script_url, trial_end)
+        grant_status.reject(grant_id, f"enqueue failed: {e}", error_kind="transient")
+        raise
+    return 202, {"status": "queued", "grant_id": grant_id}
+
+
+def push_raw(raw: bytes) -> str:
+    """Async mode: park the body for the drainer. One Redis round trip; returns the grant_id."""
+    grant_id = uuid.uuid4().hex
+    pipe = get_redis().pipeline(transaction=False)
+    grant_status.receive(grant_id, pipe)
+    # Decoded here so a non-UTF-8 body can't wedge the (decode_responses) drainer
+    pipe.lpush(INGEST_KEY, f"{grant_id}\n" + raw.decode("utf-8", "replace"))
+    pipe.execute()
+    return grant_id
+
+
+def _split(item: str) -> tuple:
+    """(grant_id or None, body); bodies pushed before grant ids existed have no prefix."""
+    head, sep, body = item.partition("\n")
+    if sep and len(head) == 32 and "{" not in head:
+        return head, body
+    return None, item
+
+
+def drain_forever():
+    """Process pushed bodies oldest first; bodies in flight at a crash are re-queued on start."""
+    r = get_redis()
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda *_: stopping.append(True))
+    while r.lmove(INGEST_PROCESSING_KEY, INGEST_KEY, "RIGHT", "RIGHT"):
+        pass
+    print("📥 Webhook drainer up")
+    while not stopping:
+        item = r.blmove(INGEST_KEY, INGEST_PROCESSING_KEY, 1, "RIGHT", "LEFT")
+        if item is None:
+            continue
+        grant_id, raw = _split(item)
+        try:
+            status, body = process_body(raw, grant_id)
+            if status >= 400:
+                print(f"❌ Dropped webhook body ({status} {body['error']}): {raw[:200]!r}")
+        except Exception as e:
+            print(f"❌ Webhook body failed: {e}")
+            if grant_id:
+                grant_status.reject(grant_id, f"ingest failed: {e}")
+        r.lrem(INGEST_PROCESSING_KEY, 1, item)
+    print("👋 Webhook drainer stopped")
+
+
+if __name__ == "__main__":
+    drain_forever()
@@ -0,0 +1,185 @@
+# metrics.py
+"""
+Prometheus-style metrics aggregated through Redis.
+
+Workers (any process, any dyno) add to histograms and counters stored in
+Redis hashes; the Flask app renders them all in the Prometheus text format
+on /metrics. Writes are best-effort: a Redis hiccup never fails a grant.
+
+    with span("goto"):
+        await page.goto(url)
+
+    inc("tvab_grants_total", outcome="success")
+    observe("tvab_queue_lag_seconds", 1.7, worker="celery")
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+PREFIX = "metrics"
+NAMES_KEY = f"{PREFIX}:names:{{kind}}"   # set of metric names per kind ("c" or "h"), read by render_metrics
+
+# Seconds; grants range from sub-second steps to multi-minute stuck runs
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+DEPTH_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21)
+BUCKETS_FOR = {"tvab_selector_fallback_depth": DEPTH_BUCKETS}
+
+HELP = {
+    "tvab_step_seconds": ("histogram", "Duration of each grant step"),
+    "tvab_selector_wins_total": ("counter", "Selector that matched, per step"),
+    "tvab_selector_fallback_depth": ("histogram", "Position of the winning selector in the candidate list"),
+    "tvab_selector_failures_total": ("counter", "Steps where no candidate selector matched"),
+    "tvab_grants_total": ("counter", "Grant outcomes"),
+    "tvab_expiry_updates_total": ("counter", "Expiry changes on users who already had access"),
+    "tvab_backend_fallbacks_total": ("counter", "Grants a backend handed on to the next one"),
+    "tvab_username_lookups_total": ("counter", "Username pre-validation results"),
+    "tvab_queue_lag_seconds": ("histogram", "Time from enqueue to the worker starting the grant"),
+    "tvab_queue_depth": ("gauge", "Jobs waiting in the broker"),
+    "tvab_lane_wait_seconds": ("histogram", "Time a grant waited in its scheduler lane"),
+    "tvab_lane_depth": ("gauge", "Grants waiting in each scheduler lane"),
+}
+
+# Step currently running in this task (read by other modules, e.g. for status/artifacts)
+current_step: ContextVar[Optional[str]] = ContextVar("current_step", default=None)
+
+# Called with the step name as each span starts (grant_status registers one)
+STEP_HOOKS = []
+
+
+def _redis():
+    try:
+        from redis_client import get_redis
+        return get_redis()
+    except Exception:
+        return None
+
+
+def _labels(labels: dict) -> str:
+    return ",".join(f'{k}="{str(v)}"' for k, v in sorted(labels.items()) if v is not None)
+
+
+def inc(name: str, amount: float = 1, **labels):
+    r = _redis()
+    if r is None:
+        return
+    try:
+        pipe = r.pipeline(transaction=False)
+        pipe.hincrbyfloat(f"{PREFIX}:c:{name}", _labels(labels), amount)
+        pipe.sadd(NAMES_KEY.format(kind="c"), name)
+        pipe.execute()
+    except Exception:
+        pass
+
+
+def observe(name: str, value: float, **labels):
+    r = _redis()
+    if r is None:
+        return
+    lbl = _labels(labels)
+    try:
+        pipe = r.pipeline(transaction=False)
+        key = f"{PREFIX}:h:{name}"
+        for b in BUCKETS_FOR.get(name, BUCKETS):
+            if value <= b:
+                pipe.hincrby(key, f"{lbl}|{b:g}", 1)
+        pipe.hincrby(key, f"{lbl}|+Inf", 1)
+        pipe.hincrbyfloat(key, f"{lbl}|sum", value)
+        pipe.sadd(NAMES_KEY.format(kind="h"), name)
+        pipe.execute()
+    except Exception:
+        pass
+
+
+@contextmanager
+def span(step: str, **labels):
+    """Time a grant step into tvab_step_seconds{step, outcome}."""
+    token = current_step.set(step)
+    for hook in STEP_HOOKS:
+        hook(step)
+    t0 = time.perf_counter()
+    outcome = "ok"
+    try:
+        yield
+    except BaseException:
+        outcome = "error"
+        raise
+    finally:
+        elapsed = time.perf_counter() - t0
+        current_step.reset(token)
+        observe("tvab_step_seconds", elapsed, step=step, outcome=outcome, **labels)
+        print(f"⏱️ {step}: {elapsed:.2f}s ({outcome})")
+
+
+# ---------- Rendering (web side) ----------
+def _queue_depths(r) -> dict:
+    from dispatch import JOBS_KEY
+    depths = {}
+    for queue, key in (("celery", "celery"), ("asyncio", JOBS_KEY)):
+        try:
+            depths[queue] = r.llen(key)
+        except Exception:
+            pass
+    return depths
+
+
+def _metric_hashes(r, kind: str) -> list:
+    """[(name, hash contents)] for every metric of `kind`, from the names set (no keyspace scan)."""
+    names_key = NAMES_KEY.format(kind=kind)
+    names = r.smembers(names_key)
+    if not names:
+        # Metrics written before the names set existed: register them once
+        names = {key.split(":", 2)[2] for key in r.scan_iter(f"{PREFIX}:{kind}:*")}
+        if names:
+            r.sadd(names_key, *names)
+    names = sorted(names)
+    pipe = r.pipeline(transaction=False)
+    for name in names:
+        pipe.hgetall(f"{PREFIX}:{kind}:{name}")
+    return list(zip(names, pipe.execute()))
+
+
+def render_metrics() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    r = _redis()
+    if r is None:
+        return ""
+    lines = []
+
+    def header(name):
+        kind, text = HELP.get(name, ("untyped", name))
+        lines.append(f"# HELP {name} {text}")
+        lines.append(f"# TYPE {name} {kind}")
+
+    for name, values in _metric_hashes(r, "c"):
+        header(name)
+        for lbl, value in sorted(values.items()):
+            lines.append(f"{name}{{{lbl}}} {float(value):g}" if lbl else f"{name} {float(value):g}")
+
+    for name, values in _metric_hashes(r, "h"):
+        header(name)
+        series = {}
+        for field, value in values.items():
+            lbl, _, le = field.rpartition("|")
+            series.setdefault(lbl, {})[le] = value
+        for lbl, fields in sorted(series.items()):
+            sep = "," if lbl else ""
+            bounds = BUCKETS_FOR.get(name, BUCKETS)
+            for b in bounds:
+                count = fields.get(f"{b:g}", 0)
+                lines.append(f'{name}_bucket{{{lbl}{sep}le="{b:g}"}} {int(count)}')
+            total = int(fields.get("+Inf", 0))
+            lines.append(f'{name}_bucket{{{lbl}{sep}le="+Inf"}} {total}')
+            lines.append(f"{name}_sum{{{lbl}}} {float(fields.get('sum', 0)):g}" if lbl else f"{name}_sum {float(fields.get('sum', 0)):g}")
+            lines.append(f"{name}_count{{{lbl}}} {total}" if lbl else f"{name}_count {total}")
+
+    header("tvab_queue_depth")
+    for queue, depth in _queue_depths(r).items():
+        lines.append(f'tvab_queue_depth{{queue="{queue}"}} {depth}')
+
+    from scheduler import lane_depths
+    header("tvab_lane_depth")
+    for lane, depth in lane_depths().items():
+        lines.append(f'tvab_lane_depth{{lane="{lane}"}} {depth}')
+
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,306 @@
+# mock_tradingview.py
+"""
+Local stand-in for the TradingView pieces the grant flow touches:
+the script page, the "Manage access" dialog, the "Add new users" tab,
+user search (/username_hint/), the expiration checkbox/date input, the
+Grant button (POST /pine_perm/add/) and the existing-users list
+(POST /pine_perm/list_users/, newest first, paginated with ?limit/&offset).
+
+    python mock_tradingview.py --port 8765 --variant b --search-delay 400
+
+Then point the flow at http://127.0.0.1:8765/script/abc123-demo/.
+
+Markup variants:
+  a - current TradingView markup (div rows, "Apply", "Grant access")
+  b - drifted markup (table rows, "Save", a "Done" primary button)
+
+Every username is found by search except the ones starting with
+`missing_prefix` (default "ghost").
+
+The XHR endpoints also serve the HTTP grant backend (grant_backends.py).
+With `session` set, they answer 403 unless the request carries that
+sessionid cookie (the browser flow only sends it with cookies scoped to
+the mock's host).
+"""
+import json
+import time
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+
+DEFAULT_CONFIG = {
+    "variant": "a",
+    "page_delay_ms": 0,      # script page HTML
+    "dialog_delay_ms": 150,  # Manage access -> dialog rendered
+    "search_delay_ms": 300,  # /username_hint/
+    "grant_delay_ms": 400,   # /pine_perm/add/ and /pine_perm/modify_user_expiration/
+    "heavy_images": 6,       # ~200 KB images on the script page (for the lean profile)
+    "image_delay_ms": 0,     # each of those images
+    "missing_prefix": "ghost",
+    "session": None,         # required sessionid cookie on XHRs (None = accept anything)
+}
+
+IMAGE_BYTES = b"\x89PNG\r\n\x1a\n" + b"\0" * 200_000
+
+PAGE_HTML = """<!doctype html>
+<html><head><meta charset="utf-8"><title>Mock script {pine_id}</title>
+<style>
+  .hidden {{ display: none; }}
+  [role=dialog] {{ position: fixed; top: 40px; left: 40px; right: 40px; background: #fff; border: 1px solid #999; padding: 16px; }}
+  .user-row, tr {{ margin: 4px 0; }}
+</style></head>
+<body>
+<h1>Mock indicator</h1>
+<script>window.initData = {{"scriptIdPart": "{pine_id}"}};</script>
+<div id="gallery">{images}</div>
+<button id="manage">Manage access</button>
+
+<div id="dialog" role="dialog" class="hidden">
+  <div role="tablist">
+    <div role="tab" id="tab-existing" aria-selected="true">Existing users</div>
+    <div role="tab" id="tab-add" aria-selected="false">Add new users</div>
+  </div>
+  <div id="panel-add" class="hidden">
+    <input id="search" type="text" placeholder="Search for users to grant them access">
+    <div id="results"></div>
+    <div id="expiry" class="hidden">
+      <label><input id="noexp" type="checkbox" checked> No expiration date</label>
+      <div id="datebox" class="hidden calendar-popover">
+        <input id="date" placeholder="YYYY-MM-DD">
+        <button id="apply" data-name="submit-button">{apply_label}</button>
+      </div>
+      <button id="grant" class="{grant_class}">{grant_label}</button>
+    </div>
+    <div id="status"></div>
+  </div>
+</div>
+
+<script>
+const VARIANT = "{variant}";
+const DIALOG_DELAY = {dialog_delay_ms};
+let selected = null;
+const $ = id => document.getElementById(id);
+const show = (el, on) => el.classList.toggle("hidden", !on);
+
+$("manage").onclick = () => setTimeout(() => show($("dialog"), true), DIALOG_DELAY);
+$("tab-add").onclick = () => {{
+  $("tab-add").setAttribute("aria-selected", "true");
+  $("tab-existing").setAttribute("aria-selected", "false");
+  show($("panel-add"), true);
+}};
+
+async function search() {{
+  const q = $("search").value.trim();
+  if (!q) return;
+  const resp = await fetch("/username_hint/?s=" + encodeURIComponent(q));
+  const users = await resp.json();
+  const box = $("results");
+  box.innerHTML = "";
+  const container = VARIANT === "b" ? document.createElement("table") : box;
+  for (const u of users) {{
+    const row = document.createElement(VARIANT === "b" ? "tr" : "div");
+    if (VARIANT !== "b") row.className = "user-row";
+    const name = document.createElement(VARIANT === "b" ? "td" : "span");
+    name.textContent = "@" + u.username;
+    const btn = document.createElement("button");
+    btn.textContent = "Add access";
+    btn.onclick = () => {{ selected = u.username; show($("expiry"), true); }};
+    row.append(name, btn);
+    container.append(row);
+  }}
+  if (container !== box) box.append(container);
+}}
+$("search").addEventListener("keydown", e => {{ if (e.key === "Enter") search(); }});
+
+$("noexp").onchange = () => show($("datebox"), !$("noexp").checked);
+$("apply").onclick = () => show($("datebox"), false);
+
+$("grant").onclick = async () => {{
+  const body = new URLSearchParams({{pine_id: "{pine_id}", username_recip: selected}});
+  if (!$("noexp").checked && $("date").value) body.set("expiration", $("date").value + "T23:59:59.999Z");
+  const resp = await fetch("/pine_perm/add/", {{method: "POST", body}});
+  const data = await resp.json();
+  $("status").textContent = data.status === "ok" ? "Access granted to @" + selected : "Error";
+  // back to a clean "Add new users" tab, like TradingView after a grant
+  show($("expiry"), false);
+  $("results").innerHTML = "";
+  $("search").value = "";
+  $("noexp").checked = true;
+  selected = null;
+}};
+</script>
+</body></html>
+"""
+
+
+class MockTradingView:
+    """Config + state shared by request handlers (access list per pine_id)."""
+
+    def __init__(self, **config):
+        self.config = {**DEFAULT_CONFIG, **config}
+        self.access = {}   # pine_id -> {username: expiration or None}
+        self.lock = threading.Lock()
+
+    def sleep(self, key):
+        ms = self.config.get(key, 0)
+        if ms:
+            time.sleep(ms / 1000)
+
+    def pine_id_for(self, slug: str) -> str:
+        return "PUB;" + slug.split("-")[0]
+
+    def render_page(self, slug: str) -> str:
+        variant = self.config["variant"]
+        images = "".join(f'<img src="/static/img/{i}.png" width="10">' for i in range(self.config["heavy_images"]))
+        return PAGE_HTML.format(
+            pine_id=self.pine_id_for(slug),
+            images=images,
+            variant=variant,
+            dialog_delay_ms=self.config["dialog_delay_ms"],
+            apply_label="Save" if variant == "b" else "Apply",
+            grant_label="Done" if variant == "b" else "Grant access",
+            grant_class="btn-primary" if variant == "b" else "primary",
+        )
+
+    def search(self, query: str) -> list:
+        query = query.strip().lstrip("@")
+        if not query or query.lower().startswith(self.config["missing_prefix"]):
+            return []
+        # the exact user plus a look-alike, as TradingView returns prefix matches
+        return [{"username": query}, {"username": query + "_fan"}]
+
+    def grant(self, pine_id: str, username: str, expiration):
+        with self.lock:
+            self.access.setdefault(pine_id, {})[username] = expiration
+
+    def modify_expiration(self, pine_id: str, username: str, expiration) -> bool:
+        """False when the user has no access to change."""
+        with self.lock:
+            users = self.access.get(pine_id, {})
+            if username not in users:
+                return False
+            users[username] = expiration
+            return True
+
+    def list_users(self, pine_id: str, offset: int, limit: int) -> dict:
+        with self.lock:
+            users = list(self.access.get(pine_id, {}).items())
+        users.reverse()   # dicts keep grant order; newest first
+        page = users[offset:offset + limit]
+        more = offset + limit < len(users)
+        return {
+            "count": len(users),
+            "next": f"/pine_perm/list_users/?limit={limit}&offset={offset + limit}" if more else None,
+            "results": [{"username": u, "expiration": exp} for u, exp in page],
+        }
+
+
+def make_handler(mock: MockTradingView):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status, body, content_type="application/json"):
+            if isinstance(body, (dict, list)):
+                body = json.dumps(body)
+            if isinstance(body, str):
+                body = body.encode()
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _form(self) -> dict:
+            length = int(self.headers.get("Content-Length") or 0)
+            raw = self.rfile.read(length).decode() if length else ""
+            if self.headers.get("Content-Type", "").startswith("application/json"):
+                return json.loads(raw or "{}")
+            return {k: v[0] for k, v in parse_qs(raw).items()}
+
+        def _authorized(self) -> bool:
+            session = mock.config.get("session")
+            return session is None or f"sessionid={session}" in (self.headers.get("Cookie") or "")
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            parts = [p for p in url.path.split("/") if p]
+            if len(parts) == 2 and parts[0] == "script":
+                mock.sleep("page_delay_ms")
+                return self._send(200, mock.render_page(parts[1]), "text/html; charset=utf-8")
+            if url.path == "/username_hint/":
+                if not self._authorized():
+                    return self._send(403, {"detail": "Authentication credentials were not provided."})
+                mock.sleep("search_delay_ms")
+                return self._send(200, mock.search(parse_qs(url.query).get("s", [""])[0]))
+            if url.path.startswith("/static/img/"):
+                mock.sleep("image_delay_ms")
+                return self._send(200, IMAGE_BYTES, "image/png")
+            return self._send(404, {"error": "not found"})
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            form = self._form()
+            if not self._authorized():
+                return self._send(403, {"detail": "Authentication credentials were not provided."})
+            if url.path == "/pine_perm/add/":
+                mock.sleep("grant_delay_ms")
+                username = form.get("username_recip")
+                if not username or not mock.search(username):
+                    return self._send(422, {"status": "error", "detail": "user not found"})
+                mock.grant(form.get("pine_id"), username, form.get("expiration"))
+                return self._send(200, {"status": "ok"})
+            if url.path == "/pine_perm/modify_user_expiration/":
+                mock.sleep("grant_delay_ms")
+                if not mock.modify_expiration(form.get("pine_id"), form.get("username_recip"), form.get("expiration")):
+                    return self._send(422, {"status": "error", "detail": "user has no access"})
+                return self._send(200, {"status": "ok"})
+            if url.path == "/pine_perm/list_users/":
+                query = parse_qs(url.query)
+                offset = int(query.get("offset", ["0"])[0])
+                limit = int(query.get("limit", ["30"])[0])
+                return self._send(200, mock.list_users(form.get("pine_id"), offset, limit))
+            return self._send(404, {"error": "not found"})
+
+    return Handler
+
+
+def start_mock_server(host: str = "127.0.0.1", port: int = 0, **config):
+    """Start in a daemon thread. Returns (server, mock, base_url); call server.shutdown() to stop."""
+    mock = MockTradingView(**config)
+    server = ThreadingHTTPServer((host, port), make_handler(mock))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, mock, f"http://{host}:{server.server_address[1]}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mock TradingView script page / Manage access dialog")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--variant", choices=["a", "b"], default="a")
+    parser.add_argument("--page-delay", type=int, default=DEFAULT_CONFIG["page_delay_ms"])
+    parser.add_argument("--dialog-delay", type=int, default=DEFAULT_CONFIG["dialog_delay_ms"])
+    parser.add_argument("--search-delay", type=int, default=DEFAULT_CONFIG["search_delay_ms"])
+    parser.add_argument("--grant-delay", type=int, default=DEFAULT_CONFIG["grant_delay_ms"])
+    parser.add_argument("--image-delay", type=int, default=DEFAULT_CONFIG["image_delay_ms"])
+    parser.add_argument("--session", default=None, help="sessionid cookie the XHR endpoints require")
+    args = parser.parse_args()
+
+    server, _, base_url = start_mock_server(
+        args.host, args.port,
+        variant=args.variant,
+        page_delay_ms=args.page_delay,
+        dialog_delay_ms=args.dialog_delay,
+        search_delay_ms=args.search_delay,
+        grant_delay_ms=args.grant_delay,
+        image_delay_ms=args.image_delay,
+        session=args.session,
+    )
+    print(f"🧪 Mock TradingView on {base_url}/script/abc123-demo/ (variant {args.variant})")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,210 @@
+# reconcile.py
+"""
+Reconcile TradingView access lists with the WooCommerce subscription export.
+
+    python reconcile.py subscriptions.csv [--dry-run] [--full]
+
+The export is a CSV with tradingview_username, tradingview_script_url and
+trial_end_date_gmt columns (plus an optional status), or a JSON / JSONL dump
+of WooCommerce subscriptions, read with the webhook's extract_fields.
+
+For each script in the export, the current access list is read over HTTP
+(/pine_perm/list_users/, newest first) and diffed against the export. Users
+who are missing are queued as one batch in the backfill lane. Users whose
+expiry differs from their trial end are queued as expiry changes
+(/pine_perm/modify_user_expiration/ over HTTP, see dispatch.submit_expiry);
+they skip the scheduler lanes, being one cheap call each. Nobody is ever
+removed.
+
+A snapshot per script (access list + hashes) is cached in Redis:
+  * if the first page of the access list is unchanged, the cached list is
+    reused instead of paging through all of it (--full pages anyway)
+  * if, in addition, the export rows for the script are unchanged and the
+    last run queued nothing, the script is skipped outright
+"""
+import os
+import csv
+import json
+import time
+import asyncio
+import hashlib
+import argparse
+from typing import Optional
+from redis_client import get_redis
+from account_pool import lease
+from grant_backends import HttpBackend
+from grant_ledger import expiry_date, forget_grant, normalize_username
+from dispatch import GRANT_SCHEDULER, submit_batch, submit_expiry
+from scheduler import enqueue_scheduled, script_key
+
+# Subscription statuses that should have access (rows without a status count as active)
+RECONCILE_ACTIVE_STATUSES = {
+    s.strip() for s in os.getenv("RECONCILE_ACTIVE_STATUSES", "active,pending-cancel").split(",") if s.strip()
+}
+
+SNAPSHOT_KEY = "reconcile:snapshot:{script}"   # JSON: head, desired, users, pending, at
+SNAPSHOT_TTL_SECONDS = 7 * 24 * 3600
+
+
+def _digest(obj) -> str:
+    return hashlib.sha1(json.dumps(obj, sort_keys=True).encode()).hexdigest()
+
+
+def _rows(path: str):
+    """Yield (username, script_url, trial_end_gmt, status) from a CSV, JSON or JSONL export."""
+    if path.endswith(".csv"):
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            for row in csv.DictReader(f):
+                yield (
+                    row.get("tradingview_username"),
+                    row.get("tradingview_script_url"),
+                    row.get("trial_end_date_gmt") or row.get("trial_end_gmt") or None,
+                    row.get("status"),
+                )
+        return
+
+    from ingest import extract_fields
+    with open(path, encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            payloads = (json.loads(line) for line in f if line.strip())
+        else:
+            payloads = json.load(f)
+        for payload in payloads:
+            yield (*extract_fields(payload), payload.get("status"))
+
+
+def load_export(path: str) -> dict:
+    """script_url -> {normalized username: (username, trial_end_gmt)} for active subscriptions."""
+    desired = {}
+    for username, script_url, trial_end_gmt, status in _rows(path):
+        if not username or not script_url:
+            continue
+        if status and status not in RECONCILE_ACTIVE_STATUSES:
+            continue
+        users = desired.setdefault(script_url, {})
+        key = normalize_username(username)
+        # Several subscriptions for the same user/script: the latest end wins
+        if key not in users or (trial_end_gmt or "") > (users[key][1] or ""):
+            users[key] = (username.strip().lstrip("@"), trial_end_gmt)
+    return desired
+
+
+def load_snapshot(script_url: str) -> Optional[dict]:
+    try:
+        raw = get_redis().get(SNAPSHOT_KEY.format(script=script_key(script_url)))
+        return json.loads(raw) if raw else None
+    except Exception:
+        return None
+
+
+def save_snapshot(script_url: str, snapshot: dict):
+    try:
+        get_redis().set(SNAPSHOT_KEY.format(script=script_key(script_url)), json.dumps(snapshot),
+                        ex=SNAPSHOT_TTL_SECONDS)
+    except Exception as e:
+        print(f"⚠️ Could not save snapshot for {script_url}: {e}")
+
+
+async def read_access(backend: HttpBackend, script_url: str, snapshot: Optional[dict], full: bool) -> tuple:
+    """(normalized username -> expiry date or None, head hash, reused cached list?)"""
+    async with lease(script_url) as acct:
+        users, next_url, count = await backend.list_users_page(script_url, acct)
+        head = _digest([count, users])
+        if snapshot and not full and snapshot.get("head") == head:
+            return snapshot["users"], head, True
+
+        access, pages = {}, 1
+        while True:
+            for u in users:
+                access[normalize_username(u["username"])] = (u["expiration"] or "")[:10] or None
+            if not next_url:
+                break
+            users, next_url, _ = await backend.list_users_page(script_url, acct, next_url)
+            pages += 1
+        print(f"📄 {script_url}: read {len(access)} users in {pages} pages")
+        return access, head, False
+
+
+def diff(desired: dict, access: dict) -> list:
+    """(username, trial_end_gmt, reason) for every export row TradingView doesn't reflect."""
+    fixes = []
+    for key, (username, trial_end_gmt) in sorted(desired.items()):
+        if key not in access:
+            fixes.append((username, trial_end_gmt, "missing"))
+        elif trial_end_gmt and access[key] != expiry_date(trial_end_gmt):
+            fixes.append((username, trial_end_gmt, "expiry"))
+    return fixes
+
+
+def enqueue_fixes(script_url: str, fixes: list):
+    """Queue grants for the "missing" rows of `fixes` and expiry changes for the "expiry" ones."""
+    for username, _, _ in fixes:
+        forget_grant(username, script_url)
+    missing = [(username, trial_end_gmt) for username, trial_end_gmt, reason in fixes if reason == "missing"]
+    if GRANT_SCHEDULER:
+        for username, trial_end_gmt in missing:
+            enqueue_scheduled(username, script_url, trial_end_gmt, lane="backfill")
+    else:
+        submit_batch(script_url, missing)
+    for username, trial_end_gmt, reason in fixes:
+        if reason == "expiry":
+            submit_expiry(username, script_url, trial_end_gmt)
+
+
+async def reconcile_script(backend: HttpBackend, script_url: str, desired: dict,
+                           dry_run: bool = False, full: bool = False) -> dict:
+    snapshot = load_snapshot(script_url)
+    desired_hash = _digest(desired)
+    access, head, reused = await read_access(backend, script_url, snapshot, full)
+    if reused and snapshot.get("desired") == desired_hash and not snapshot.get("pending"):
+        print(f"⏭️ {script_url}: unchanged since last run")
+        return {"script_url": script_url, "status": "unchanged", "missing": 0, "expiry": 0}
+
+    fixes = diff(desired, access)
+    missing = sum(reason == "missing" for _, _, reason in fixes)
+    expiry = len(fixes) - missing
+    print(f"🔎 {script_url}: {len(desired)} subscribers, {len(access)} with access, "
+          f"{missing} missing, {expiry} wrong expiry")
+    for username, trial_end_gmt, reason in fixes:
+        if reason == "expiry":
+            print(f"📅 {username}: TradingView has {access[normalize_username(username)]}, "
+                  f"export says {expiry_date(trial_end_gmt)}")
+    if fixes and not dry_run:
+        enqueue_fixes(script_url, fixes)
+    if not dry_run:
+        save_snapshot(script_url, {
+            "head": head, "desired": desired_hash, "users": access, "pending": len(fixes), "at": time.time(),
+        })
+    return {"script_url": script_url, "status": "queued" if fixes else "ok", "missing": missing, "expiry": expiry}
+
+
+async def reconcile(path: str, dry_run: bool = False, full: bool = False) -> list:
+    desired = load_export(path)
+    print(f"📦 Export: {sum(len(u) for u in desired.values())} active subscriptions on {len(desired)} scripts")
+    backend = HttpBackend()
+    results = []
+    try:
+        for script_url, users in desired.items():
+            try:
+                results.append(await reconcile_script(backend, script_url, users, dry_run, full))
+            except Exception as e:
+                print(f"❌ {script_url}: {type(e).__name__}: {e}")
+                results.append({"script_url": script_url, "status": "error", "error": str(e)})
+    finally:
+        await backend.aclose()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Queue grants for subscribers whose TradingView access is missing or wrong")
+    parser.add_argument("export", help="WooCommerce subscription export (.csv, .json or .jsonl)")
+    parser.add_argument("--dry-run", action="store_true", help="report the diff, queue nothing")
+    parser.add_argument("--full", action="store_true", help="read every page of every access list")
+    args = parser.parse_args()
+
+    results = asyncio.run(reconcile(args.export, args.dry_run, args.full))
+    queued = sum(r.get("missing", 0) for r in results)
+    expiry = sum(r.get("expiry", 0) for r in results)
+    errors = sum(r["status"] == "error" for r in results)
+    print(f"✅ {len(results)} scripts, {queued} grants and {expiry} expiry changes "
+          f"{'to queue' if args.dry_run else 'queued'}, {errors} errors")
@@ -0,0 +1,27 @@
+# redis_client.py
+import os
+from typing import Optional
+import redis
+from dotenv import load_dotenv
+
+# Every tier imports this module early, so .env is loaded before any config is read from it
+load_dotenv()
+
+BROKER_URL = (
+    os.getenv("CELERY_BROKER_URL")
+    or os.getenv("REDIS_URL")
+    or "redis://localhost:6379/0"
+)
+
+_client: Optional[redis.Redis] = None
+
+
+def get_redis() -> redis.Redis:
+    """Shared client on the broker Redis (same instance Celery uses)."""
+    global _client
+    if _client is None:
+        kwargs = {"decode_responses": True}
+        if BROKER_URL.startswith("rediss://"):
+            kwargs["ssl_cert_reqs"] = None
+        _client = redis.Redis.from_url(BROKER_URL, **kwargs)
+    return _client
@@ -0,0 +1,226 @@
+# scheduler.py
+"""
+Rate-limited, prioritised scheduling in front of the grant workers.
+
+With GRANT_SCHEDULER=1, dispatch.enqueue_grant parks grants in Redis lanes
+instead of sending them straight to a worker. This process then releases
+them:
+
+  * lanes in strict priority order: paid > trial > backfill
+  * round-robin across scripts inside a lane, so one busy script (or a
+    bulk backfill) cannot starve the others
+  * a token bucket per script_url and per TradingView account; a grant is
+    released only when the script and one of its accounts have a token, so
+    bursts against one script or one session are smoothed out. The worker
+    leases that account first (account_pool.lease)
+
+Released grants continue through dispatch.route_grant (batching, worker
+mode) as before. Queue wait per lane is exported as tvab_lane_wait_seconds.
+
+    python scheduler.py
+"""
+import os
+import json
+import time
+import signal
+import hashlib
+from typing import Optional
+from redis_client import get_redis
+from metrics import observe
+import account_pool
+
+LANES = ("paid", "trial", "backfill")
+
+# Tokens per minute and burst size
+GRANT_RATE_PER_SCRIPT_PER_MIN  = float(os.getenv("GRANT_RATE_PER_SCRIPT_PER_MIN", "6"))
+GRANT_BURST_PER_SCRIPT         = float(os.getenv("GRANT_BURST_PER_SCRIPT", "3"))
+GRANT_RATE_PER_ACCOUNT_PER_MIN = float(os.getenv("GRANT_RATE_PER_ACCOUNT_PER_MIN", "20"))
+GRANT_BURST_PER_ACCOUNT        = float(os.getenv("GRANT_BURST_PER_ACCOUNT", "5"))
+
+QUEUE_KEY  = "grant:lane:{lane}:q:{script}"   # list of jobs for one script in one lane
+RING_KEY   = "grant:lane:{lane}:ring"         # scripts with pending jobs, rotated for fairness
+ACTIVE_KEY = "grant:lane:{lane}:active"       # set mirror of the ring
+DEPTH_KEY  = "grant:lane:depth"               # hash: lane -> queued jobs
+BUCKET_KEY = "grant:bucket:{kind}:{name}"
+
+# Push a job; put its script on the ring if it was idle
+ENQUEUE_LUA = """
+redis.call('RPUSH', KEYS[1], ARGV[2])
+if redis.call('SADD', KEYS[3], ARGV[1]) == 1 then
+    redis.call('RPUSH', KEYS[2], ARGV[1])
+end
+redis.call('HINCRBY', KEYS[4], ARGV[3], 1)
+"""
+
+# Pop a job; take the script off the ring once its queue is empty
+POP_LUA = """
+local job = redis.call('LPOP', KEYS[1])
+if job then
+    redis.call('HINCRBY', KEYS[4], ARGV[2], -1)
+end
+if redis.call('LLEN', KEYS[1]) == 0 then
+    redis.call('LREM', KEYS[2], 0, ARGV[1])
+    redis.call('SREM', KEYS[3], ARGV[1])
+end
+return job
+"""
+
+# Take one token from every bucket, or none. Returns "0", or the seconds until all could pay.
+TAKE_TOKENS_LUA = """
+local now = tonumber(ARGV[1])
+local wait = 0
+local levels = {}
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[2 * i])
+    local burst = tonumber(ARGV[2 * i + 1])
+    local state = redis.call('HMGET', key, 'tokens', 'ts')
+    local tokens = tonumber(state[1]) or burst
+    local ts = tonumber(state[2]) or now
+    tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+    levels[i] = tokens
+    if tokens < 1 then
+        wait = math.max(wait, (1 - tokens) / rate)
+    end
+end
+if wait > 0 then
+    return tostring(wait)
+end
+for i, key in ipairs(KEYS) do
+    redis.call('HSET', key, 'tokens', tostring(levels[i] - 1), 'ts', tostring(now))
+    redis.call('EXPIRE', key, 3600)
+end
+return '0'
+"""
+
+_scripts = {}
+
+
+def _lua(name: str, source: str):
+    if name not in _scripts:
+        _scripts[name] = get_redis().register_script(source)
+    return _scripts[name]
+
+
+def script_key(script_url: str) -> str:
+    return hashlib.sha1(script_url.encode()).hexdigest()[:16]
+
+
+def lane_for(payload: dict, trial_end_gmt: Optional[str]) -> str:
+    """Explicit `priority` from the payload if valid, else trial vs paid from the trial end."""
+    lane = (payload.get("priority") or "").lower()
+    if lane in LANES:
+        return lane
+    return "trial" if trial_end_gmt else "paid"
+
+
+def accounts_for(script_url: str) -> list:
+    """
+    Healthy TradingView accounts that can grant on this script (see account_pool).
+    With none left, the grant is still released so the worker fails it loudly.
+    """
+    return account_pool.accounts_for(script_url) or [None]
+
+
+def enqueue_scheduled(username: str, script_url: str, trial_end_gmt: Optional[str] = None, lane: str = "paid",
+                      grant_id: Optional[str] = None):
+    if lane not in LANES:
+        lane = "paid"
+    script = script_key(script_url)
+    job = json.dumps({
+        "username": username, "script_url": script_url, "trial_end_gmt": trial_end_gmt,
+        "lane": lane, "grant_id": grant_id, "enqueued_at": time.time(),
+    })
+    _lua("enqueue", ENQUEUE_LUA)(
+        keys=[QUEUE_KEY.format(lane=lane, script=script), RING_KEY.format(lane=lane),
+              ACTIVE_KEY.format(lane=lane), DEPTH_KEY],
+        args=[script, job, lane],
+    )
+
+
+def take_tokens(script_url: str, account: Optional[str]) -> float:
+    """0 if a grant may start now (tokens taken), else seconds to wait."""
+    keys = [BUCKET_KEY.format(kind="script", name=script_key(script_url)),
+            BUCKET_KEY.format(kind="account", name=account or "none")]
+    args = [time.time(),
+            GRANT_RATE_PER_SCRIPT_PER_MIN / 60, GRANT_BURST_PER_SCRIPT,
+            GRANT_RATE_PER_ACCOUNT_PER_MIN / 60, GRANT_BURST_PER_ACCOUNT]
+    return float(_lua("tokens", TAKE_TOKENS_LUA)(keys=keys, args=args))
+
+
+def _peek_script_url(lane: str, script: str) -> Optional[str]:
+    raw = get_redis().lindex(QUEUE_KEY.format(lane=lane, script=script), 0)
+    return json.loads(raw)["script_url"] if raw else None
+
+
+def release_one(lane: str) -> tuple:
+    """
+    Try each script in `lane` once, in ring order. Release the first grant whose
+    script and account both have a token. Returns (released?, seconds until a retry could succeed).
+    """
+    from dispatch import route_grant
+
+    r = get_redis()
+    ring = RING_KEY.format(lane=lane)
+    soonest = None
+    for _ in range(r.llen(ring)):
+        # Rotate: head goes to the tail, so the next pass starts with the next script
+        script = r.lmove(ring, ring, "LEFT", "RIGHT")
+        if script is None:
+            break
+        script_url = _peek_script_url(lane, script)
+        if script_url is None:
+            continue
+
+        waits = []
+        for account in accounts_for(script_url):
+            wait = take_tokens(script_url, account)
+            if wait == 0:
+                break
+            waits.append(wait)
+        else:
+            wait = min(waits)
+            soonest = wait if soonest is None else min(soonest, wait)
+            continue
+
+        raw = _lua("pop", POP_LUA)(
+            keys=[QUEUE_KEY.format(lane=lane, script=script), ring, ACTIVE_KEY.format(lane=lane), DEPTH_KEY],
+            args=[script, lane],
+        )
+        if raw is None:
+            continue
+        job = json.loads(raw)
+        observe("tvab_lane_wait_seconds", time.time() - job["enqueued_at"], lane=lane)
+        route_grant(job["username"], job["script_url"], job.get("trial_end_gmt"), account, job.get("grant_id"))
+        return True, 0.0
+    return False, soonest
+
+
+def lane_depths() -> dict:
+    try:
+        return {lane: int(v) for lane, v in (get_redis().hgetall(DEPTH_KEY) or {}).items()}
+    except Exception:
+        return {}
+
+
+def run_forever(idle_sleep: float = 0.5):
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda *_: stopping.append(True))
+    print("🚦 Grant scheduler up")
+    while not stopping:
+        # Keeps accounts_for() honest about expired sessions
+        account_pool.check_due()
+        released, soonest = False, None
+        # Strict priority: a lower lane only gets a turn when no higher lane can release
+        for lane in LANES:
+            released, wait = release_one(lane)
+            if released:
+                break
+            if wait is not None:
+                soonest = wait if soonest is None else min(soonest, wait)
+        if not released:
+            time.sleep(min(idle_sleep, soonest) if soonest else idle_sleep)
+    print("👋 Grant scheduler stopped")
+
+
+if __name__ == "__main__":
+    run_forever()
@@ -0,0 +1,156 @@
+# selector_resolver.py
+import os
+import asyncio
+from collections import defaultdict
+from typing import Optional
+from playwright.async_api import expect, TimeoutError as PlaywrightTimeoutError
+from metrics import inc, observe
+
+# Redis keys (best-effort persistence; the resolver works without Redis)
+WINNERS_KEY = "selector:winners"       # hash: step -> selector
+STATS_KEY   = "selector:stats"         # hash: "<step>:hit|miss|fail" -> count
+
+# Once a lower-ranked candidate is visible, how long higher-ranked ones still get to show up
+SELECTOR_GRACE_MS = int(os.getenv("SELECTOR_GRACE_MS", "1500"))
+
+
+def _redis():
+    try:
+        from redis_client import get_redis
+        return get_redis()
+    except Exception:
+        return None
+
+
+class SelectorResolver:
+    """
+    Wait for all candidate selectors at once under one shared deadline.
+
+    The caller's order always decides: when a candidate shows up, the ones
+    ranked above it still get SELECTOR_GRACE_MS to appear, so a generic
+    fallback already on the page (a comment form's "Post" button) can't beat
+    the real button rendering a moment late. For a named `step`, the selector
+    that won last time is still checked first, but only the caller's top
+    choice is taken without the grace period. Counters per step:
+      hit  - the remembered selector matched again
+      miss - a different selector won (TradingView markup probably changed)
+      fail - nothing matched before the deadline
+    """
+
+    def __init__(self):
+        self.winners = {}
+        self.stats = defaultdict(lambda: {"hit": 0, "miss": 0, "fail": 0})
+        self._loaded = False
+
+    def _load(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        r = _redis()
+        if r is None:
+            return
+        try:
+            self.winners.update(r.hgetall(WINNERS_KEY) or {})
+        except Exception as e:
+            print(f"⚠️ Could not load selector winners: {e}")
+
+    def _record(self, step: Optional[str], outcome: str, selector: Optional[str] = None, depth: int = 0):
+        if not step:
+            return
+        self.stats[step][outcome] += 1
+        if selector is None:
+            inc("tvab_selector_failures_total", step=step)
+        else:
+            inc("tvab_selector_wins_total", step=step, selector=selector.replace('"', "'"))
+            # 0 = the caller's first choice; higher means we fell through to fallbacks
+            observe("tvab_selector_fallback_depth", depth, step=step)
+        changed = selector is not None and self.winners.get(step) != selector
+        if changed:
+            self.winners[step] = selector
+        r = _redis()
+        if r is None:
+            return
+        try:
+            pipe = r.pipeline(transaction=False)
+            pipe.hincrby(STATS_KEY, f"{step}:{outcome}", 1)
+            if changed:
+                pipe.hset(WINNERS_KEY, step, selector)
+            pipe.execute()
+        except Exception:
+            pass
+
+    async def _visible_up_to(self, page, selectors: list, last: str) -> Optional[str]:
+        """The first candidate (in the caller's order, up to `last`) visible right now."""
+        for sel in selectors[: selectors.index(last) + 1]:
+            try:
+                if await page.locator(sel).first.is_visible():
+                    return sel
+            except Exception:
+                continue
+        return None
+
+    async def resolve(self, page, selectors: list, timeout: int, step: Optional[str] = None):
+        """Return a Locator for the highest-priority candidate that becomes visible."""
+        if step:
+            self._load()
+        order = list(selectors)
+        remembered = self.winners.get(step) if step else None
+
+        # Fast path: the remembered selector is the caller's first choice and already on screen
+        if remembered in order and order.index(remembered) == 0 and await self._visible_up_to(page, order, remembered):
+            self._record(step, "hit", remembered, 0)
+            return await _settle(page.locator(remembered).first)
+
+        loop = asyncio.get_running_loop()
+        tasks = {
+            asyncio.create_task(page.locator(sel).first.wait_for(state="visible", timeout=timeout)): sel
+            for sel in order
+        }
+        best = None        # index in `order` of the best candidate seen so far
+        grace_until = None
+        try:
+            pending = set(tasks)
+            while pending:
+                wait = timeout / 1000 + 1 if grace_until is None else max(0.0, grace_until - loop.time())
+                done, pending = await asyncio.wait(pending, timeout=wait, return_when=asyncio.FIRST_COMPLETED)
+                for t in done:
+                    if t.exception() is None:
+                        rank = order.index(tasks[t])
+                        best = rank if best is None else min(best, rank)
+                if best is not None:
+                    if grace_until is None:
+                        grace_until = loop.time() + SELECTOR_GRACE_MS / 1000
+                    # Only candidates ranked above the best one can still change the outcome
+                    pending = {t for t in pending if order.index(tasks[t]) < best}
+                    if loop.time() >= grace_until:
+                        break
+                elif not done:
+                    break
+        finally:
+            for t in tasks:
+                t.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        if best is None:
+            self._record(step, "fail")
+            raise PlaywrightTimeoutError(f"None of selectors {selectors} became visible")
+        first_sel = order[best]
+
+        # Several candidates can be visible at once: keep the caller's precedence
+        winner = await self._visible_up_to(page, order, first_sel) or first_sel
+
+        self._record(step, "hit" if winner == remembered else "miss", winner, selectors.index(winner))
+        return await _settle(page.locator(winner).first)
+
+
+async def _settle(loc):
+    # best-effort: also wait enabled briefly if possible
+    try:
+        await expect(loc).to_be_enabled(timeout=800)
+    except Exception:
+        pass
+    return loc
+
+
+# Process-wide resolver shared by all grants in this worker
+resolver = SelectorResolver()
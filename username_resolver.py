@@ -0,0 +1,98 @@
+# username_resolver.py
+"""
+Resolve a customer-typed TradingView username before any browser is involved.
+
+"@SomeUser ", "someuser" and https://www.tradingview.com/u/SomeUser/ all
+normalize to "someuser", which is looked up once through /username_hint/
+and cached with TradingView's own spelling. Names that don't exist go to a
+shorter-lived negative cache, so a repeated typo fails in one Redis GET
+instead of a browser run. If the lookup itself can't be trusted (network,
+unexpected response), the normalized name is used as is and the grant flow
+decides.
+"""
+import os
+import re
+from typing import Optional
+from redis_client import get_redis
+from account_pool import lease
+from grant_errors import BackendValidationError, UserNotFoundError
+from metrics import inc
+
+USERNAME_CACHE_TTL_SECONDS = int(os.getenv("USERNAME_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+# Short: the customer may create the account right after a failed purchase
+USERNAME_NEGATIVE_TTL_SECONDS = int(os.getenv("USERNAME_NEGATIVE_TTL_SECONDS", "3600"))
+
+FOUND_KEY   = "tvuser:found:{name}"     # -> username as TradingView spells it
+MISSING_KEY = "tvuser:missing:{name}"
+
+PROFILE_URL_RE = re.compile(r"tradingview\.com/u/([^/?#\s]+)", re.IGNORECASE)
+USERNAME_RE = re.compile(r"^[\w.-]{1,64}$")
+
+
+def normalize(username: str) -> str:
+    """Strip whitespace, a leading @ and a pasted profile URL; keeps the case."""
+    username = (username or "").strip()
+    match = PROFILE_URL_RE.search(username)
+    if match:
+        username = match.group(1)
+    return username.lstrip("@").strip()
+
+
+def _cached(key: str) -> tuple:
+    try:
+        return tuple(get_redis().mget(FOUND_KEY.format(name=key), MISSING_KEY.format(name=key)))
+    except Exception:
+        return None, None
+
+
+def _remember(key: str, found: Optional[str]):
+    try:
+        if found:
+            get_redis().set(FOUND_KEY.format(name=key), found, ex=USERNAME_CACHE_TTL_SECONDS)
+        else:
+            get_redis().set(MISSING_KEY.format(name=key), 1, ex=USERNAME_NEGATIVE_TTL_SECONDS)
+    except Exception as e:
+        print(f"⚠️ Could not cache username lookup: {e}")
+
+
+def known_user(username: str) -> bool:
+    """True if a lookup (cached) confirmed this user exists."""
+    found, _ = _cached(normalize(username).lower())
+    return bool(found)
+
+
+async def resolve_username(username: str, script_url: str, backend, account: Optional[str] = None) -> str:
+    """
+    The TradingView spelling of `username`, looked up with `backend` (an HttpBackend).
+    Raises UserNotFoundError if it is malformed or TradingView has no such user.
+    """
+    name = normalize(username)
+    if not USERNAME_RE.match(name):
+        inc("tvab_username_lookups_total", result="invalid")
+        raise UserNotFoundError(f"'{username}' is not a valid TradingView username", "resolve")
+
+    key = name.lower()
+    found, missing = _cached(key)
+    if found:
+        inc("tvab_username_lookups_total", result="cached")
+        return found
+    if missing:
+        inc("tvab_username_lookups_total", result="cached_missing")
+        raise UserNotFoundError(f"TradingView user '{name}' does not exist (cached)", "resolve")
+
+    try:
+        async with lease(script_url, prefer=account) as acct:
+            found = await backend.lookup_user(name, script_url, acct)
+    except BackendValidationError as e:
+        inc("tvab_username_lookups_total", result="unverified")
+        print(f"⚠️ Could not pre-validate '{name}' ({e}) – continuing unverified")
+        return name
+
+    _remember(key, found)
+    if found is None:
+        inc("tvab_username_lookups_total", result="missing")
+        raise UserNotFoundError(f"TradingView user '{name}' does not exist", "resolve")
+    inc("tvab_username_lookups_total", result="found")
+    if found != name:
+        print(f"🔤 Resolved '{username}' to TradingView user '{found}'")
+    return found
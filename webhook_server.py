@@ -1,56 +1,47 @@
 # webhook_server.py
 import os
-import json
-from flask import Flask, request, jsonify
-from celery_worker import async_grant_access
+import threading
+from flask import Flask, Response, request, jsonify
+from ingest import WEBHOOK_INGEST_MODE, WEBHOOK_MAX_BYTES, process_body, push_raw
+from metrics import render_metrics
+from grant_status import wait_for_final
 
-app = Flask(__name__)
-
-def extract_fields(payload: dict):
-    # פורמט “פשוט”
-    if "tradingview_username" in payload and "tradingview_script_url" in payload:
-        return (
-            payload.get("tradingview_username"),
-            payload.get("tradingview_script_url"),
-            payload.get("trial_end_date_gmt") or payload.get("trial_end_gmt"),
-        )
-
-    # פורמט WooCommerce Subscriptions
-    username = None
-    for meta in payload.get("meta_data", []):
-        if meta.get("key") == "tradingview_username":
-            username = meta.get("value")
-            break
-
-    script_url = None
-    for item in payload.get("line_items", []):
-        for meta in item.get("meta_data", []):
-            if meta.get("key") == "tradingview_script_url":
-                script_url = meta.get("value")
-                break
-        if script_url:
-            break
+# Long-polls hold a gthread thread each; keep this well below --threads (Procfile) so /webhook is never starved
+GRANT_STATUS_MAX_POLLS = int(os.getenv("GRANT_STATUS_MAX_POLLS", "8"))
+_polls = threading.BoundedSemaphore(GRANT_STATUS_MAX_POLLS)
 
-    trial_end = payload.get("trial_end_date_gmt") or payload.get("trial_end_gmt")
-    return username, script_url, trial_end
+app = Flask(__name__)
+app.config["MAX_CONTENT_LENGTH"] = WEBHOOK_MAX_BYTES
 
 @app.post("/webhook")
 def webhook():
-    try:
-        data = request.get_json(force=True, silent=False)
-    except Exception:
-        return jsonify({"error": "invalid json"}), 400
-
-    username, script_url, trial_end = extract_fields(data)
-    if not username or not script_url:
-        return jsonify({"error": "missing username or script_url"}), 400
-
-    # לוג עזר
-    app.logger.warning(f"enqueue async_grant_access: user={username}, url={script_url}, trial_end_gmt={trial_end}")
-
-    # קריאה עם 3 פרמטרים!
-    async_grant_access.delay(username, script_url, trial_end)
-    return jsonify({"status": "queued"}), 202
+    raw = request.get_data(cache=False)   # 413 above MAX_CONTENT_LENGTH
+    if WEBHOOK_INGEST_MODE == "async":
+        # Ack right away; `python ingest.py` validates and enqueues
+        grant_id = push_raw(raw)
+        return jsonify({"status": "accepted", "grant_id": grant_id}), 202
+    status, body = process_body(raw)
+    return jsonify(body), status
+
+@app.get("/grants/<grant_id>")
+def grant(grant_id):
+    # ?wait=<seconds>: long-poll until the grant is final (capped by GRANT_STATUS_MAX_WAIT_SECONDS).
+    # With every poll slot taken, answer with the record as it stands; the client polls again.
+    wait = request.args.get("wait", 0, type=float)
+    if wait <= 0 or not _polls.acquire(blocking=False):
+        record = wait_for_final(grant_id, 0)
+    else:
+        try:
+            record = wait_for_final(grant_id, wait)
+        finally:
+            _polls.release()
+    if record is None:
+        return jsonify({"error": "unknown grant_id"}), 404
+    return jsonify(record)
+
+@app.get("/metrics")
+def metrics():
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
 
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=int(os.getenv("PORT", "8080")), debug=True)